@@ -0,0 +1,5 @@
+import sys
+
+from .batchimport import main
+
+sys.exit(main())
@@ -0,0 +1,178 @@
+"""Imports all xmind files in a directory tree into an anki collection without the GUI"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from anki.collection import Collection
+
+from .consts import X_MODEL_NAME
+from .dto.compiledsheetdto import CompiledSheetDTO
+from .dto.deckselectiondialoguserinputsdto import DeckSelectionDialogUserInputsDTO
+from .mapcompiler import MapCompiler, compileSheets, sheetTag
+from .noteindex import rebuildIndex
+from .template import add_x_model
+from .xminder import XmindImporter
+
+X_FILE_EXTENSION = '.xmind'
+
+
+def findMaps(path: str) -> List[str]:
+    """
+    Returns the absolute paths of all xmind files in the directory tree at path in a stable order, or path itself if it
+    is an xmind file
+    """
+    if os.path.isfile(path):
+        return [os.path.abspath(path)]
+    maps = []
+    for directory, directoryNames, fileNames in os.walk(path):
+        directoryNames.sort()
+        maps.extend(os.path.abspath(os.path.join(directory, f)) for f in sorted(fileNames)
+                    if f.lower().endswith(X_FILE_EXTENSION))
+    return maps
+
+
+def loadDeckMapping(path: Optional[str]) -> Dict[str, str]:
+    """
+    Reads a json object that maps paths of maps or directories, relative to the imported path, to names of decks
+    """
+    if not path:
+        return dict()
+    with open(path, encoding='utf-8') as file:
+        mapping = json.load(file)
+    return {key.replace('\\', '/').strip('/'): deckName for key, deckName in mapping.items()}
+
+
+def getDeckName(mapPath: str, root: str, mapping: Dict[str, str], defaultDeck: Optional[str]) -> Optional[str]:
+    """
+    Returns the deck of the most specific entry in mapping that matches the map at mapPath, the default deck if there is
+    none
+    """
+    if os.path.isfile(root):
+        root = os.path.dirname(root)
+    relativePath = os.path.relpath(mapPath, root).replace(os.sep, '/')
+    matches = [key for key in mapping if key in ('', '.') or relativePath == key or relativePath.startswith(key + '/')]
+    if not matches:
+        return defaultDeck
+    return mapping[max(matches, key=len)]
+
+
+def compileMap(mapPath: str, deckName: str, allSheets: bool = False, jobs: int = 1) -> List[CompiledSheetDTO]:
+    """
+    Compiles the notes of the first or all sheets of the map at mapPath in up to jobs processes, runs in the worker
+    processes of importMaps() with a single job
+    """
+    compiler = MapCompiler(file=mapPath)
+    try:
+        sheets = [s for s in compiler.content.sheets if s.rootTopic] if allSheets else compiler.content.sheets[:1]
+        return compileSheets(compiler=compiler, sheets=sheets,
+                             tags=[sheetTag(deckName=deckName, sheet=sheet) for sheet in sheets], jobs=jobs)
+    finally:
+        compiler.close()
+
+
+def writeMap(col: Collection, mapPath: str, deckName: str, compiledSheets: List[CompiledSheetDTO],
+             repair: bool = False) -> XmindImporter:
+    """
+    Adds, updates and removes the notes of a compiled map like an import from the GUI, without committing
+    """
+    importer = XmindImporter(col=col, file=mapPath)
+    userInputs = DeckSelectionDialogUserInputsDTO(repair=repair, deck_id=col.decks.id(deckName), deck_name=deckName)
+    importer.writeSheets(user_inputs=userInputs, compiledSheets=compiledSheets)
+    importer.compiler.close()
+    return importer
+
+
+def importMaps(col: Collection, maps: List[tuple], jobs: int = 1, repair: bool = False, allSheets: bool = False,
+               out=sys.stdout) -> Dict[str, int]:
+    """
+    Imports the maps into the collection, each map in a transaction of its own. Maps are compiled in jobs worker
+    processes and written to the collection one after another in the order of maps. A single map is compiled with its
+    sheets in jobs worker processes instead.
+    :param col: the collection to import the maps into
+    :param maps: tuples of the path of a map and the name of the deck to import it into
+    :param jobs: the number of processes to compile maps in
+    :param repair: whether to match notes by their content instead of their question ids
+    :param allSheets: whether to import all sheets of each map instead of only the first one
+    :param out: stream to write the result of each map to
+    :return: total numbers of added, updated and removed notes and of failed maps
+    """
+    if not col.models.by_name(X_MODEL_NAME):
+        add_x_model(col)
+        col.save()
+    totals = dict(added=0, updated=0, removed=0, failed=0)
+    executor = ProcessPoolExecutor(max_workers=jobs) if jobs > 1 and len(maps) > 1 else None
+    try:
+        if executor:
+            results = [executor.submit(compileMap, mapPath, deckName, allSheets) for mapPath, deckName in maps]
+        else:
+            results = [None] * len(maps)
+        for (mapPath, deckName), result in zip(maps, results):
+            try:
+                compiledSheets = result.result() if result else compileMap(mapPath, deckName, allSheets, jobs)
+                importer = writeMap(col=col, mapPath=mapPath, deckName=deckName, compiledSheets=compiledSheets,
+                                    repair=repair)
+            except Exception as exception:
+                col.rollback()
+                totals['failed'] += 1
+                print('%s: Error: %s' % (mapPath, exception), file=out)
+                continue
+            if not importer.running:
+                col.rollback()
+                totals['failed'] += 1
+                print('%s: %s' % (mapPath, ' '.join(importer.log)), file=out)
+                continue
+            col.save()
+            for key, count in importer.counts.items():
+                totals[key] += count
+            print('%s: %s' % (mapPath, importer.log[0]), file=out)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    return totals
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m smr', description='Imports or synchronizes all xmind maps under a path into an anki collection.')
+    parser.add_argument('collection', help='path of the collection (.anki2) to import the maps into')
+    parser.add_argument('path', nargs='?', help='an xmind file or a directory to search for xmind files')
+    parser.add_argument('-m', '--mapping', help='json file that maps paths of maps or directories, relative to path, to '
+                                                'deck names, the most specific entry wins')
+    parser.add_argument('-d', '--deck', help='deck for maps without an entry in the mapping file, maps without a deck '
+                                             'are skipped')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of processes to compile maps in')
+    parser.add_argument('--all-sheets', action='store_true', help='import all sheets of each map instead of the first')
+    parser.add_argument('--repair', action='store_true',
+                        help='match existing notes by their content, e.g. after the map was edited in xmind zen')
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help='rebuild the index of the SMR notes in the collection before importing, e.g. after '
+                             'notes were changed by a version of SMR without the index')
+    args = parser.parse_args(argv)
+    if not args.path and not args.rebuild_index:
+        parser.error('the following arguments are required: path')
+
+    mapping = loadDeckMapping(args.mapping)
+    maps = []
+    for mapPath in findMaps(args.path) if args.path else []:
+        deckName = getDeckName(mapPath=mapPath, root=args.path, mapping=mapping, defaultDeck=args.deck)
+        if deckName:
+            maps.append((mapPath, deckName))
+        else:
+            print('%s: skipped, no deck specified' % mapPath)
+    col = Collection(args.collection)
+    try:
+        if args.rebuild_index:
+            print('Indexed %s notes' % rebuildIndex(col))
+            col.save()
+        if not args.path:
+            return 0
+        totals = importMaps(col=col, maps=maps, jobs=max(args.jobs, 1), repair=args.repair,
+                            allSheets=args.all_sheets)
+    finally:
+        col.close()
+    print('Imported %s maps: added %s, updated %s, removed %s notes, %s maps failed' % (
+        len(maps) - totals['failed'], totals['added'], totals['updated'], totals['removed'], totals['failed']))
+    return 1 if totals['failed'] else 0
@@ -8,6 +8,17 @@ X_MAX_ANSWERS = 20
 X_CARD_NAMES = list(map(lambda aswid: 'Answer ' + str(aswid),
                         list(range(1, X_MAX_ANSWERS + 1))))
 
+# Parsers for reading the content.xml of xmind files
+X_PARSER_STREAM = 'stream'
+X_PARSER_SOUP = 'soup'
+
+# Number of notes that are inserted and get their cards generated at once when importing maps
+X_NOTE_INSERT_CHUNK_SIZE = 1000
+
+# Cache for parsed xmind files, increase the version whenever the cached data changes
+X_MAP_CACHE_VERSION = 1
+X_MAP_CACHE_MAX_BYTES = 100 * 1024 * 1024
+
 # Fields, use orderedDict to be able to access flds field in notes objects by
 # postition of dictionary key
 X_FLDS = OrderedDict((('rf', 'Reference'), ('qt', 'Question')))
@@ -23,6 +34,11 @@ X_FLDS_IDS = ['rf', 'qt'] + \
              list(map(lambda aswid: 'a' + str(aswid),
                       list(range(1, X_MAX_ANSWERS + 1)))) + \
              ['id', 'mt']
+# Position of the meta field in the fields of a note
+X_FLDS_META_INDEX = X_FLDS_IDS.index('mt')
+# Fields of a note that contain the question and the answers
+X_FLDS_CONTENT_SLICE = slice(X_FLDS_IDS.index('qt'),
+                             X_FLDS_IDS.index('a' + str(X_MAX_ANSWERS)) + 1)
 
 # Elements for creating Card-Fronts and Backs
 
@@ -114,3 +130,9 @@ X_CARD_CSS = """.card {
 ADDON_PATH = os.path.dirname(__file__)
 
 ICONS_PATH = os.path.join(ADDON_PATH, "../icons")
+
+USER_FILES_PATH = os.path.join(ADDON_PATH, "../user_files")
+
+MAP_CACHE_PATH = os.path.join(USER_FILES_PATH, "map_cache")
+
+DIRTY_NOTES_PATH = os.path.join(USER_FILES_PATH, "dirty_notes")
@@ -0,0 +1,86 @@
+"""Ids of the SMR notes that were edited since the last SMR Sync"""
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, Optional, Set
+
+from anki.collection import Collection
+
+from .consts import DIRTY_NOTES_PATH
+
+# The ids are kept in memory while a collection is open since writing to the collection's database from the hooks that
+# report edits would clear anki's undo queue. They are stored in a file in the add-on's user files when the collection
+# is closed. While the collection is open, the file says that all notes are dirty so that edits are not lost if the
+# collection is not closed properly. None instead of a set of ids means that all notes need to be checked since notes
+# may have been edited without being recorded, e.g. on other devices.
+_dirtyNotes: Dict[str, Optional[Set[int]]] = dict()
+
+
+def dirtyNotesFile(col: Collection) -> str:
+    """
+    Returns the path of the file with the dirty notes of the collection
+    """
+    return os.path.join(DIRTY_NOTES_PATH, hashlib.sha1(os.path.abspath(col.path).encode('utf-8')).hexdigest() +
+                        '.json')
+
+
+def writeDirtyNotesFile(col: Collection, nids: Optional[Set[int]]) -> None:
+    os.makedirs(DIRTY_NOTES_PATH, exist_ok=True)
+    with open(dirtyNotesFile(col), 'w') as file:
+        json.dump(dict(path=os.path.abspath(col.path), nids=None if nids is None else sorted(nids)), file)
+
+
+def loadDirtyNotes(col: Collection) -> None:
+    """
+    Reads the dirty notes of the collection from its file, all notes are dirty if there is no file since earlier edits
+    were not recorded
+    """
+    try:
+        with open(dirtyNotesFile(col)) as file:
+            nids = json.load(file)['nids']
+        nids = None if nids is None else set(nids)
+    except (OSError, KeyError, TypeError, ValueError):
+        nids = None
+    _dirtyNotes[os.path.abspath(col.path)] = nids
+    writeDirtyNotesFile(col, None)
+
+
+def saveDirtyNotes(col: Collection) -> None:
+    """
+    Writes the dirty notes of the collection to its file, needs to be called before the collection is closed
+    """
+    writeDirtyNotesFile(col, _getDirtyNotes(col))
+
+
+def _getDirtyNotes(col: Collection) -> Optional[Set[int]]:
+    key = os.path.abspath(col.path)
+    if key not in _dirtyNotes:
+        loadDirtyNotes(col)
+    return _dirtyNotes[key]
+
+
+def markNotesDirty(col: Collection, nids: Iterable[int]) -> None:
+    dirtyNotes = _getDirtyNotes(col)
+    if dirtyNotes is not None:
+        dirtyNotes.update(nids)
+
+
+def markAllNotesDirty(col: Collection) -> None:
+    """
+    Makes the next SMR Sync check all notes, needs to be called if notes may have changed without being marked
+    """
+    _getDirtyNotes(col)
+    _dirtyNotes[os.path.abspath(col.path)] = None
+
+
+def getDirtyNotes(col: Collection) -> Optional[Set[int]]:
+    """
+    Returns the ids of the notes that were edited since the last SMR Sync or None if all notes need to be checked
+    """
+    dirtyNotes = _getDirtyNotes(col)
+    return None if dirtyNotes is None else set(dirtyNotes)
+
+
+def clearDirtyNotes(col: Collection) -> None:
+    _getDirtyNotes(col)
+    _dirtyNotes[os.path.abspath(col.path)] = set()
@@ -0,0 +1,20 @@
+import dataclasses as dc
+from typing import List
+
+from .noterecorddto import NoteRecordDTO
+
+
+@dc.dataclass
+class CompiledSheetDTO:
+    """
+    Data transfer object for the notes and media compiled from a sheet of an xmind map
+    """
+    sheetId: str
+    tag: str
+    # notes in the order of their questions in the map
+    notes: List[NoteRecordDTO] = dc.field(default_factory=list)
+    # media references as returned by utils.getNodeContent(), each image or file is only referenced once
+    media: List[dict] = dc.field(default_factory=list)
+    # False if the sheet could not be compiled, log then contains the reason
+    running: bool = True
+    log: List[str] = dc.field(default_factory=list)
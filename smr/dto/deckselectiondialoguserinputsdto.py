@@ -12,4 +12,6 @@ class DeckSelectionDialogUserInputsDTO:
     repair: bool = False
     deck_id: Optional[int] = None
     deck_name: str = ''
+    # Whether to import all sheets of the map instead of only the first one
+    all_sheets: bool = False
     running: bool = True
@@ -0,0 +1,12 @@
+import dataclasses as dc
+from typing import List
+
+
+@dc.dataclass
+class NoteRecordDTO:
+    """
+    Data transfer object for the fields of a stepwise map retrieval note compiled from a question of an xmind map
+    """
+    questionId: str
+    # contents of the note's fields in the order of X_FLDS
+    fields: List[str] = dc.field(default_factory=list)
@@ -0,0 +1,233 @@
+"""Due cards of the deck that is reviewed in SMR mode, kept up to date between the cards the user answers"""
+import threading
+from typing import AbstractSet, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from anki.cards import Card
+from anki.consts import QUEUE_TYPE_LRN, QUEUE_TYPE_NEW, QUEUE_TYPE_REV
+from anki.utils import ids2str
+
+from .reviewgraph import DueCounts, ReviewGraph
+
+_dueQueues = None
+
+
+class DueQueues:
+    """
+    The learning, review and new cards the SMR scheduler chooses from, selected like the queues of anki's v2
+    scheduler: learning cards of the active decks, review cards that are due today and new cards of the current deck.
+    The cards are queried once and then updated with the cards of the notes the user answers. Learning cards are kept
+    until they are answered again so that cards whose learning step is over become due without another query.
+    """
+
+    def __init__(self, sched):
+        self.col = sched.col
+        self.did = sched._lrnDids[0]
+        self.lrnDids = tuple(sched.col.decks.active())
+        self.today = sched.today
+        # due timestamps of learning cards
+        self.lrn: Dict[int, int] = dict()
+        # review and new cards in the order of their queries, dicts are used as ordered sets
+        self.rev: Dict[int, None] = dict()
+        self.new: Dict[int, None] = dict()
+        self.nidByCid: Dict[int, int] = dict()
+        # number of review and new cards of each note
+        self.revNids: Dict[int, int] = dict()
+        self.newNids: Dict[int, int] = dict()
+        # held while the next card is selected on a worker thread and while the queues are updated
+        self.lock = threading.Lock()
+        # number of updates after answers
+        self.version = 0
+        # numbers of due cards in the descendant index of the review graph the scheduler selects from, updated with
+        # every card that is added or removed
+        self.dueCounts: Optional[DueCounts] = None
+        for cid, nid, queue, due in self.col.db.execute(
+                "select id, nid, queue, due from cards where did in %s and queue = ?" % ids2str(self.lrnDids),
+                QUEUE_TYPE_LRN):
+            self.addCard(cid=cid, nid=nid, queue=queue, due=due)
+        for cid, nid, queue, due in self.col.db.execute(
+                "select id, nid, queue, due from cards where did = ? and queue = ? and due <= ?", self.did,
+                QUEUE_TYPE_REV, self.today):
+            self.addCard(cid=cid, nid=nid, queue=queue, due=due)
+        for cid, nid, queue, due in self.col.db.execute(
+                "select id, nid, queue, due from cards where did = ? and queue = ? order by due, ord", self.did,
+                QUEUE_TYPE_NEW):
+            self.addCard(cid=cid, nid=nid, queue=queue, due=due)
+
+    def isOutdated(self, sched) -> bool:
+        """
+        Whether the day has rolled over or the deck that is studied with sched has changed since the queues were
+        queried
+        """
+        return self.col is not sched.col or self.did != sched._lrnDids[0] or self.today != sched.today or \
+            self.lrnDids != tuple(sched.col.decks.active())
+
+    def lrnQueue(self, now: float, excludedCid: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Returns tuples of due timestamps and ids of the learning cards that are due at now, without the card with id
+        excludedCid
+        """
+        return [(due, cid) for cid, due in self.lrn.items() if due < now and cid != excludedCid]
+
+    def lrnNids(self, now: float, excludedCid: Optional[int] = None) -> Set[int]:
+        return set(self.nidByCid[cid] for cid, due in self.lrn.items() if due < now and cid != excludedCid)
+
+    def revNoteIds(self, excludedCid: Optional[int] = None) -> 'NoteIds':
+        return NoteIds(counts=self.revNids, excludedNid=self.nidByCid[excludedCid] if excludedCid in self.rev else None)
+
+    def newNoteIds(self, excludedCid: Optional[int] = None) -> 'NoteIds':
+        return NoteIds(counts=self.newNids, excludedNid=self.nidByCid[excludedCid] if excludedCid in self.new else None)
+
+    def dueCids(self, now: float, excludedCid: Optional[int] = None) -> 'DueCids':
+        return DueCids(dueQueues=self, now=now, excludedCid=excludedCid)
+
+    def getDueCounts(self, graph: ReviewGraph) -> DueCounts:
+        """
+        Returns the numbers of due cards in the descendant index of graph, counts all cards in the queues including
+        learning cards that are not due yet
+        """
+        index = graph.descendantIndex()
+        if self.dueCounts is None or self.dueCounts.index is not index:
+            self.dueCounts = index.dueCounts(graph=graph, nids=self.nidByCid.values())
+        return self.dueCounts
+
+    def addCard(self, cid: int, nid: int, queue: int, due: int, did: Optional[int] = None) -> None:
+        """
+        Adds the card to the queue it belongs to, if any, a card's deck is only checked if did is given
+        """
+        if queue == QUEUE_TYPE_LRN and (did is None or did in self.lrnDids):
+            self.lrn[cid] = due
+        elif queue == QUEUE_TYPE_REV and due <= self.today and (did is None or did == self.did):
+            self.rev[cid] = None
+            self.revNids[nid] = self.revNids.get(nid, 0) + 1
+        elif queue == QUEUE_TYPE_NEW and (did is None or did == self.did):
+            self.new[cid] = None
+            self.newNids[nid] = self.newNids.get(nid, 0) + 1
+        else:
+            return
+        self.nidByCid[cid] = nid
+        if self.dueCounts:
+            self.dueCounts.add(nid, 1)
+
+    def removeCard(self, cid: int) -> None:
+        nid = self.nidByCid.pop(cid, None)
+        if nid is None:
+            return
+        if self.dueCounts:
+            self.dueCounts.add(nid, -1)
+        self.lrn.pop(cid, None)
+        for cards, nids in ((self.rev, self.revNids), (self.new, self.newNids)):
+            if cid in cards:
+                del cards[cid]
+                nids[nid] -= 1
+                if not nids[nid]:
+                    del nids[nid]
+
+    def updateNote(self, nid: int) -> None:
+        """
+        Moves the cards of the note to the queues they belong to after one of them was answered, answering a card may
+        also bury its siblings
+        """
+        with self.lock:
+            self.version += 1
+            for cid, did, queue, due in self.col.db.execute("select id, did, queue, due from cards where nid = ?",
+                                                            nid):
+                # cards that stay in the review or new queue keep their place
+                if queue == QUEUE_TYPE_NEW and cid in self.new or \
+                        queue == QUEUE_TYPE_REV and due <= self.today and cid in self.rev:
+                    continue
+                self.removeCard(cid)
+                self.addCard(cid=cid, nid=nid, queue=queue, due=due, did=did)
+
+
+class CardQueue:
+    """
+    View of the ids of the cards in the review or new queue of due queues in their order, used as the queue of anki's
+    scheduler so that it does not need to be copied for every card. Removing a card, as anki does with the siblings of
+    an answered card, is ignored since the due queues are updated with all cards of the answered card's note.
+    """
+
+    def __init__(self, cards: Dict[int, None]):
+        self.cards = cards
+
+    def __len__(self) -> int:
+        return len(self.cards)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.cards)
+
+    def __contains__(self, cid) -> bool:
+        return cid in self.cards
+
+    def remove(self, cid: int) -> None:
+        pass
+
+
+class DueCids:
+    """
+    View of the ids of the cards of due queues that are due at a time without an excluded card, only supports
+    membership tests
+    """
+
+    def __init__(self, dueQueues: DueQueues, now: float, excludedCid: Optional[int] = None):
+        self.dueQueues = dueQueues
+        self.now = now
+        self.excludedCid = excludedCid
+
+    def __contains__(self, cid) -> bool:
+        if cid == self.excludedCid:
+            return False
+        if cid in self.dueQueues.rev or cid in self.dueQueues.new:
+            return True
+        due = self.dueQueues.lrn.get(cid)
+        return due is not None and due < self.now
+
+
+class NoteIds(AbstractSet[int]):
+    """
+    View of the ids of the notes with cards in the review or new queue of due queues, a note is left out if its only
+    card in the queue is an excluded card
+    """
+
+    def __init__(self, counts: Dict[int, int], excludedNid: Optional[int] = None):
+        """
+        :param counts: the number of cards in the queue of each note
+        :param excludedNid: the id of the note of the excluded card if that card is in the queue
+        """
+        self.counts = counts
+        self.excludedNid = excludedNid
+
+    @classmethod
+    def _from_iterable(cls, nids: Iterable[int]) -> Set[int]:
+        return set(nids)
+
+    def __contains__(self, nid) -> bool:
+        return self.counts.get(nid, 0) > (nid == self.excludedNid)
+
+    def __iter__(self) -> Iterator[int]:
+        return (nid for nid in self.counts if nid in self)
+
+    def __len__(self) -> int:
+        return len(self.counts) - (self.counts.get(self.excludedNid) == 1)
+
+
+def getDueQueues(sched) -> DueQueues:
+    """
+    Returns the due queues of the deck that is studied with sched, queries them if necessary
+    """
+    global _dueQueues
+    if not _dueQueues or _dueQueues.isOutdated(sched):
+        _dueQueues = DueQueues(sched)
+    return _dueQueues
+
+
+def onCardAnswered(card: Card) -> None:
+    if _dueQueues and _dueQueues.col is card.col:
+        _dueQueues.updateNote(card.nid)
+
+
+def invalidateDueQueues() -> None:
+    """
+    Drops the due queues, needs to be called whenever cards are changed otherwise than by answering them
+    """
+    global _dueQueues
+    _dueQueues = None
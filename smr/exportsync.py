@@ -6,7 +6,10 @@ from aqt.utils import tooltip
 
 from anki.utils import split_fields
 
+from .dirtynotes import clearDirtyNotes, getDirtyNotes, markNotesDirty
 from .dto.deckselectiondialoguserinputsdto import DeckSelectionDialogUserInputsDTO
+from .mapcache import MapCache
+from .noteindex import ensureIndex
 from .utils import *
 from .xminder import XmindImporter
 
@@ -16,28 +19,46 @@ class MapSyncer:
     def __init__(self):
         self.notes2Sync = []
         self.srcDir = None
-        self.tagList = None
+        self.xZip = None
+        self.soup = None
+        self.content = None
+        self.mapCache = MapCache()
+        ensureIndex(aqt.mw.col)
         self.mediaDir = re.sub(r"(?i)\.(anki2)$", ".media", aqt.mw.col.path)
         self.manifest = None
         self.fileBin = None
 
-    def syncMaps(self):
+    def syncMaps(self, checkAllNotes=False):
         aqt.mw.progress.start(immediate=True,
                               label='processing SMR changes...')
         aqt.mw.app.processEvents()
-        self.getNotes2Sync()
+        self.getNotes2Sync(checkAllNotes=checkAllNotes)
         docs2Sync = set(map(lambda n: n['meta']['path'], self.notes2Sync))
+        unsyncedNids = []
         for doc2Sync in docs2Sync:
-            self.syncDoc(doc2Sync)
+            if not self.syncDoc(doc2Sync):
+                unsyncedNids.extend(n['nid'] for n in self.notes2Sync
+                                    if n['meta']['path'] == doc2Sync)
+        # changes of maps that were not found are exported with the next sync
+        clearDirtyNotes(aqt.mw.col)
+        markNotesDirty(aqt.mw.col, unsyncedNids)
 
         aqt.mw.col.tags.clear_unused_tags()
         aqt.mw.progress.finish()
 
-    def getNotes2Sync(self):
-        """gets all notes with fields that were changed after their last import"""
+    def getNotes2Sync(self, checkAllNotes=False):
+        """gets the notes with fields that were changed after their last import
+        among the notes that were edited since the last sync, or among all
+        notes if checkAllNotes is set or edits may not have been recorded"""
         xMid = xModelId(aqt.mw.col)
-        xNotes = list(aqt.mw.col.db.execute(
-            "select id, mod, flds from notes where mid = %s" % xMid))
+        dirtyNids = None if checkAllNotes else getDirtyNotes(aqt.mw.col)
+        if dirtyNids is None:
+            xNotes = list(aqt.mw.col.db.execute(
+                "select id, mod, flds from notes where mid = %s" % xMid))
+        else:
+            xNotes = list(aqt.mw.col.db.execute(
+                "select id, mod, flds from notes where mid = %s and id in %s" % (
+                    xMid, ids2str(dirtyNids))))
         for xNote in xNotes:
             fields = split_fields(xNote[2])
             meta = json.loads(fields[23])
@@ -47,6 +68,8 @@ class MapSyncer:
                     dict(meta=meta, fields=fields, nid=xNote[0]))
 
     def syncDoc(self, docPath):
+        """exports the changes of the notes from the map at docPath and
+        imports it again, returns False if the map was not found"""
         aqt.mw.progress.update(
             label="synchronizing %s" % os.path.basename(docPath),
             maybeShow=False)
@@ -57,68 +80,81 @@ class MapSyncer:
         notes4Doc = list(filter(lambda n: n['meta']['path'] == docPath,
                                 self.notes2Sync))
         try:
-            xZip = zipfile.ZipFile(docPath, 'r')
+            self.xZip = zipfile.ZipFile(docPath, 'r')
         except FileNotFoundError:
             log = 'File "%s" not found, changes in "%s" not exported.' % (
                 docPath, os.path.basename(docPath))
             tooltip(msg=log, period=6000, parent=aqt.mw)
-            return
-        content = xZip.read('content.xml')
-        manifestContent = xZip.read("META-INF/manifest.xml")
-        xZip.close()
-        soup = BeautifulSoup(content, features='html.parser')
-        self.manifest = BeautifulSoup(manifestContent, features='html.parser')
-        self.tagList = soup('topic')
-        sheets2Sync = set(map(lambda n: n['meta']['sheetId'], notes4Doc))
+            return False
+        self.soup = None
+        self.manifest = None
+        self.content = self.mapCache.load(docPath, self.xZip)
+        sheetIds2Sync = set(map(lambda n: n['meta']['sheetId'], notes4Doc))
         sheets2Sync = list(
-            map(lambda s: soup.find('sheet', {'id': s}), sheets2Sync))
+            filter(lambda s: s.id in sheetIds2Sync, self.content.sheets))
         if len(sheets2Sync) > 0:
-            sheet = sheets2Sync[0]
             for note in notes4Doc:
                 self.syncNote(note)
-            self.update_zip(docPath, 'content.xml', str(soup))
+            self.xZip.close()
+            # the map only has to be rewritten if a node was changed
+            if self.soup:
+                self.update_zip(docPath, 'content.xml', str(self.soup))
+                self.mapCache.put(docPath, self.content)
             # Remove temp dir and its files
             shutil.rmtree(self.srcDir)
-            # import sheets again
-            importer = XmindImporter(col=aqt.mw.col, file=docPath)
-            sheetImports = []
-            print('importing sheet')
-            tag4Sheet = next(taglist[0].strip() for taglist in aqt.mw.col.db.execute(
-                "select tags from notes where flds like '%\"sheetId\": \"" +
-                sheet['id'] + "\"%'"))
-            sheetNid = next(nid_list[0] for nid_list in aqt.mw.col.db.execute(
-                "select id from notes where flds like '%\"sheetId\": \"" +
-                sheet['id'] + "\"%'"))
-            did4Sheet = next(did_list[0] for did_list in aqt.mw.col.db.execute(
-                "select did from cards where nid = %s" % sheetNid))
-            user_inputs = DeckSelectionDialogUserInputsDTO(
-                deck_id=did4Sheet,
-                repair=False,
-                deck_name=re.search(r'^([^:]*)::', tag4Sheet).group(1)
-            )
-            importer.importSheets(user_inputs=user_inputs)
-            log = "\n".join(importer.log)
-            tooltip(log)
+            # import sheets again, each into the deck it was imported to before
+            logs = []
+            for sheet in sheets2Sync:
+                # the content already reflects the changes written to the map, so the importer can reuse it
+                importer = XmindImporter(col=aqt.mw.col, file=docPath, content=self.content)
+                tag4Sheet, did4Sheet = getSheetTagAndDeck(sheetId=sheet.id, col=aqt.mw.col)
+                tag4Sheet = tag4Sheet.strip()
+                user_inputs = DeckSelectionDialogUserInputsDTO(
+                    deck_id=did4Sheet,
+                    repair=False,
+                    deck_name=re.search(r'^([^:]*)::', tag4Sheet).group(1)
+                )
+                importer.importSheets(user_inputs=user_inputs, sheets=[sheet])
+                logs.extend(importer.log)
+            tooltip("\n".join(logs))
+        else:
+            self.xZip.close()
+        return True
 
     def syncNote(self, note):
         print('synchronizing note')
-        questionTag = getTagById(tagList=self.tagList,
-                                 tagId=note['meta']['questionId'])
-        if not questionTag:
+        questionNode = self.content.getTopic(note['meta']['questionId'])
+        if not questionNode:
             return
-        self.maybeReplaceTitle(noteContent=note['fields'][1], tag=questionTag)
+        self.maybeReplaceTitle(noteContent=note['fields'][1], node=questionNode)
 
         for aId, answer in enumerate(note['meta']['answers'], start=0):
-            answerTag = getTagById(tagList=self.tagList,
-                                   tagId=note['meta']['answers'][aId][
-                                       'answerId'])
+            answerNode = self.content.getTopic(
+                note['meta']['answers'][aId]['answerId'])
+            if not answerNode:
+                continue
             self.maybeReplaceTitle(noteContent=note['fields'][aId + 2],
-                                   tag=answerTag)
-
-    def maybeReplaceTitle(self, noteContent, tag):
-        tagContent = getNodeContent(tagList=self.tagList, tag=tag)[0]
-        if noteContent != tagContent:
+                                   node=answerNode)
+
+    def maybeReplaceTitle(self, noteContent, node):
+        nodeContent = getNodeContent(topicsById=self.content.topicsById, node=node)[0]
+        if noteContent != nodeContent:
+            # only parse the map and look up the node's tag if it actually needs to be changed
+            self.loadSoup()
+            tag = self.soup.find('topic', {'id': node.id})
             self.setNodeContent(tag=tag, noteContent=noteContent)
+            node.title = getNodeTitle(tag)
+            node.image = getNodeImg(tag)
+
+    def loadSoup(self):
+        """parses content.xml and manifest.xml of the current map for editing
+        them, unless this has already been done"""
+        if self.soup:
+            return
+        self.soup = BeautifulSoup(self.xZip.read('content.xml'),
+                                  features='html.parser')
+        self.manifest = BeautifulSoup(self.xZip.read("META-INF/manifest.xml"),
+                                      features='html.parser')
 
     def setNodeContent(self, tag, noteContent):
         noteTitle = titleFromContent(noteContent)
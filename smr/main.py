@@ -1,7 +1,17 @@
 from aqt import deckbrowser, gui_hooks
+from aqt.addcards import AddCards
+from aqt.editor import Editor
+from aqt.qt import QAction, qconnect
 from anki import hooks
 
 from .config import *
+from .dirtynotes import loadDirtyNotes, markAllNotesDirty, markNotesDirty, saveDirtyNotes
+from .duequeues import invalidateDueQueues, onCardAnswered
+from .exportsync import MapSyncer
+from .noteindex import ensureIndex, updateIndex
+from .prefetch import discardPrefetch
+from .reviewgraph import invalidateReviewGraphs
+from .utils import invalidateSMRDecks, xModelId
 from .xminder import XmindImporter
 # noinspection PyUnresolvedReferences
 from . import monkeypatches
@@ -13,6 +23,8 @@ from . import monkeypatches
 # creates smr model when loading profile if necessary
 def on_profile_loaded():
     get_or_create_model()
+    ensureIndex(mw.col)
+    loadDirtyNotes(mw.col)
     # Add SMR Sync Button to Deckbrowser
     deckbrowser.DeckBrowser.drawLinks.append(["", "sync", "SMR Sync"])
     mw.reset()
@@ -22,6 +34,74 @@ def on_profile_loaded():
 gui_hooks.profile_did_open.append(on_profile_loaded)
 
 
+# notes may have been added, changed or removed on other devices
+def on_sync_finished():
+    updateIndex(mw.col)
+    invalidateReviewGraphs()
+    invalidateSMRDecks()
+    # edits on other devices are not recorded
+    markAllNotesDirty(mw.col)
+
+
+gui_hooks.sync_did_finish.append(on_sync_finished)
+
+
+# edited, added or removed notes may change the questions the reviewer has to choose from
+def on_operation_executed(changes, handler):
+    if changes.note_text or changes.notetype:
+        invalidateReviewGraphs()
+    # remember edited notes for SMR Sync, the edited notes are only known for
+    # the editor, new notes do not need to be synchronized
+    if changes.note_text and isinstance(handler, Editor) and handler.note:
+        if handler.note.mid == xModelId(mw.col):
+            markNotesDirty(mw.col, [handler.note.id])
+    elif changes.note_text and not isinstance(handler, AddCards):
+        markAllNotesDirty(mw.col)
+    if changes.card or changes.study_queues:
+        invalidateDueQueues()
+    if changes.card or changes.deck or changes.notetype:
+        invalidateSMRDecks()
+
+
+gui_hooks.operation_did_execute.append(on_operation_executed)
+
+
+# keep the due cards of the SMR scheduler up to date without querying them again
+def on_card_answered(reviewer, card, ease):
+    onCardAnswered(card)
+
+
+gui_hooks.reviewer_did_answer_card.append(on_card_answered)
+
+
+# notes that are saved without an operation, e.g. by other add-ons
+def on_note_will_flush(note):
+    if note.id and note.mid == xModelId(note.col):
+        markNotesDirty(note.col, [note.id])
+
+
+hooks.note_will_flush.append(on_note_will_flush)
+
+
+# checking all notes repairs SMR Sync if edits were not recorded
+def on_sync_all_notes():
+    MapSyncer().syncMaps(checkAllNotes=True)
+
+
+syncAllNotesAction = QAction("SMR Sync (check all notes)", mw)
+qconnect(syncAllNotesAction.triggered, on_sync_all_notes)
+mw.form.menuTools.addAction(syncAllNotesAction)
+
+# the selection of the next card must not outlive the collection, the edited
+# notes are only stored when the collection is closed
+def on_profile_will_close():
+    discardPrefetch()
+    saveDirtyNotes(mw.col)
+
+
+gui_hooks.profile_will_close.append(on_profile_will_close)
+
+
 def importer_hook(importers):
     importers.append(("Xmind map (*.xmind)", XmindImporter))
 
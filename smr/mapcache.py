@@ -0,0 +1,177 @@
+"""Persistent cache for the parsed content of xmind files"""
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Optional
+
+from .consts import MAP_CACHE_PATH, X_MAP_CACHE_MAX_BYTES, X_MAP_CACHE_VERSION, X_PARSER_STREAM
+from .mapnode import MapNode, freezeNodes
+from .xmindloader import XmindContent, XmindSheet, loadContent
+
+_CACHE_FILE_SUFFIX = '.pickle'
+
+
+class MapCache:
+    """
+    Stores the sheets and topics of xmind files in the add-on's user files so that unchanged maps do not have to be
+    parsed again. There is one cache file per map path. An entry is valid if the map's size and modification time are
+    unchanged or, failing that, if the map's content hash is unchanged. Cache files are evicted in least recently used
+    order once the cache exceeds its maximum size and are dropped when they were written with a different
+    X_MAP_CACHE_VERSION.
+    """
+
+    def __init__(self, directory: Optional[str] = None, maxBytes: int = X_MAP_CACHE_MAX_BYTES):
+        """
+        :param directory: directory of the cache files, defaults to MAP_CACHE_PATH
+        """
+        self.directory = directory or MAP_CACHE_PATH
+        self.maxBytes = maxBytes
+
+    def load(self, path: str, xZip, parser: str = X_PARSER_STREAM) -> XmindContent:
+        """
+        Returns the content of the xmind file at path from the cache or parses it and adds it to the cache
+        :param path: path of the xmind file
+        :param xZip: the opened xmind file as zipfile.ZipFile, used if the file has to be parsed
+        :param parser: the parser to use if the file has to be parsed
+        """
+        content = self.get(path)
+        if content:
+            return content
+        content = loadContent(xZip, parser=parser)
+        self.put(path, content)
+        return content
+
+    def get(self, path: str) -> Optional[XmindContent]:
+        """
+        Returns the cached content of the xmind file at path or None if there is no valid entry for it
+        """
+        cacheFile = self.cacheFile(path)
+        try:
+            with open(cacheFile, 'rb') as file:
+                entry = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        if not isinstance(entry, dict) or entry.get('version') != X_MAP_CACHE_VERSION or entry.get('path') != \
+                os.path.abspath(path):
+            self.remove(path)
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if (entry['size'], entry['mtime']) != (stat.st_size, stat.st_mtime_ns):
+            # the file was touched, only reuse the entry if its content did not change
+            if entry['hash'] != fileHash(path):
+                return None
+            entry['size'], entry['mtime'] = stat.st_size, stat.st_mtime_ns
+            self.write(cacheFile, entry)
+        else:
+            # mark the entry as recently used
+            try:
+                os.utime(cacheFile)
+            except FileNotFoundError:
+                pass
+        return contentFromState(entry['content'])
+
+    def put(self, path: str, content: XmindContent) -> None:
+        """
+        Stores the content of the xmind file at path in its current state and evicts old entries if necessary
+        """
+        stat = os.stat(path)
+        entry = dict(version=X_MAP_CACHE_VERSION, path=os.path.abspath(path), size=stat.st_size,
+                     mtime=stat.st_mtime_ns, hash=fileHash(path), content=contentToState(content))
+        os.makedirs(self.directory, exist_ok=True)
+        self.write(self.cacheFile(path), entry)
+        self.evict()
+
+    def remove(self, path: str) -> None:
+        try:
+            os.remove(self.cacheFile(path))
+        except OSError:
+            pass
+
+    def clear(self) -> None:
+        for cacheFile in self.cacheFiles():
+            os.remove(cacheFile)
+
+    def evict(self) -> None:
+        """
+        Removes least recently used cache files until the cache is not bigger than maxBytes
+        """
+        cacheFiles = []
+        for cacheFile in self.cacheFiles():
+            # other processes importing maps at the same time may already have removed the file
+            try:
+                cacheFiles.append((os.stat(cacheFile), cacheFile))
+            except FileNotFoundError:
+                pass
+        totalBytes = sum(s.st_size for s, _ in cacheFiles)
+        for stat, cacheFile in sorted(cacheFiles, key=lambda t: t[0].st_mtime_ns):
+            if totalBytes <= self.maxBytes:
+                break
+            try:
+                os.remove(cacheFile)
+            except FileNotFoundError:
+                pass
+            totalBytes -= stat.st_size
+
+    def cacheFile(self, path: str) -> str:
+        name = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + _CACHE_FILE_SUFFIX)
+
+    def cacheFiles(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, n) for n in names if n.endswith(_CACHE_FILE_SUFFIX)]
+
+    def write(self, cacheFile: str, entry: dict) -> None:
+        # write to a temporary file first so that readers never see partially written entries
+        fileDescriptor, tempPath = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fileDescriptor, 'wb') as file:
+            pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tempPath, cacheFile)
+
+
+def fileHash(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def contentToState(content: XmindContent) -> list:
+    """
+    Flattens the content to plain tuples so that pickling does not recurse along parents, children and crosslinks.
+    Parents are stored as indices into the sheet's topics, annotations of the sheetanalyzer are not stored since they
+    are recomputed in a single pass.
+    """
+    state = []
+    for sheet in content.sheets:
+        indices = {id(node): i for i, node in enumerate(sheet.topics)}
+        attached = set(id(child) for node in sheet.topics for child in node.children)
+        state.append((sheet.id, sheet.title, indices.get(id(sheet.rootTopic)), [
+            (node.id, node.title, node.image, node.hyperlink, indices[id(node.parent)] if node.parent else None,
+             id(node) in attached) for node in sheet.topics]))
+    return state
+
+
+def contentFromState(state: list) -> XmindContent:
+    content = XmindContent()
+    for sheetId, sheetTitle, rootIndex, nodeStates in state:
+        sheet = XmindSheet(id=sheetId, title=sheetTitle)
+        for nodeId, title, image, hyperlink, parentIndex, isAttached in nodeStates:
+            parent = sheet.topics[parentIndex] if parentIndex is not None else None
+            node = MapNode(id=nodeId, title=title, image=image, hyperlink=hyperlink, parent=parent)
+            if parent and isAttached:
+                parent.children.append(node)
+            content.addTopic(node)
+            sheet.topics.append(node)
+        if rootIndex is not None:
+            sheet.rootTopic = sheet.topics[rootIndex]
+        freezeNodes(sheet.topics)
+        content.sheets.append(sheet)
+    return content
@@ -0,0 +1,472 @@
+"""Compiles the sheets of xmind files to the contents of stepwise map retrieval notes"""
+import io
+import json
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+from anki.utils import int_time
+
+from .consts import X_FLDS, X_MAX_ANSWERS, X_PARSER_STREAM
+from .dto.compiledsheetdto import CompiledSheetDTO
+from .dto.noterecorddto import NoteRecordDTO
+from .mapcache import MapCache, contentFromState, contentToState
+from .sheetanalyzer import analyzeContent
+from .utils import getAnswerDict, getCoordsFromId, getNodeContent, replaceSound, updateId
+from .xmindloader import XmindContent, XmindSheet, loadContent
+
+_QUESTION_FIELD = list(X_FLDS.keys()).index('qt')
+
+
+def sheetTag(deckName: str, sheet: XmindSheet) -> str:
+    """
+    Returns the tag of the notes imported from sheet into the deck named deckName
+    """
+    return f'{deckName}::{sheet.rootTopic.title.replace(" ", "_")}'
+
+
+def compileSheets(compiler: 'MapCompiler', sheets: List[XmindSheet], tags: List[str],
+                  jobs: int = 1) -> List[CompiledSheetDTO]:
+    """
+    Compiles the sheets of the compiler's content in up to jobs worker processes. The content is only parsed once and
+    sent to each worker in its flat MapCache state. Worker processes are only used by the command line importer, anki's
+    process cannot start them since its executable is not a plain python interpreter in anki's packaged builds.
+    :param compiler: the compiler of the file the sheets belong to
+    :param sheets: sheets of the compiler's content
+    :param tags: the tag for each sheet
+    :param jobs: maximum number of worker processes, sheets are compiled in the current process if it is 1
+    :return: the compiled sheets in the order of sheets
+    """
+    if jobs <= 1 or len(sheets) <= 1:
+        return [compiler.compileSheet(sheet=sheet, tag=tag) for sheet, tag in zip(sheets, tags)]
+    with ProcessPoolExecutor(max_workers=min(jobs, len(sheets)), initializer=_initSheetWorker,
+                             initargs=(compiler.file, compiler.data, contentToState(compiler.content))) as executor:
+        return list(executor.map(_compileSheetInWorker, [sheet.id for sheet in sheets], tags))
+
+
+# compiler of the worker process, set by _initSheetWorker()
+_workerCompiler = None
+
+
+def _initSheetWorker(file: str, data: Optional[bytes], state: list) -> None:
+    global _workerCompiler
+    _workerCompiler = MapCompiler(file=file, data=data, content=contentFromState(state))
+
+
+def _compileSheetInWorker(sheetId: str, tag: str) -> CompiledSheetDTO:
+    sheet = next(s for s in _workerCompiler.content.sheets if s.id == sheetId)
+    return _workerCompiler.compileSheet(sheet=sheet, tag=tag)
+
+
+class MapCompiler:
+    """
+    Turns the sheets of an xmind file into note records and media references. The compiler neither needs an anki
+    collection nor the GUI so it can run in worker processes, benchmarks and command line tools, writing the records to a
+    collection is left to the XmindImporter.
+    """
+
+    def __init__(self, file: str, data: Optional[bytes] = None, content: Optional[XmindContent] = None,
+                 parser: str = X_PARSER_STREAM, useMapCache: bool = True):
+        """
+        :param file: path of the xmind file, stored in the notes' meta field
+        :param data: bytes of the xmind file, if specified the file is not read from disk and the map cache is not used
+        :param content: already loaded content of the file, e.g. from the MapSyncer
+        :param parser: the parser to use if the content has to be parsed
+        :param useMapCache: whether to read and write the content from and to the MapCache
+        """
+        self.file = file
+        self.data = data
+        self.xZip = zipfile.ZipFile(io.BytesIO(data) if data is not None else file, 'r')
+        self.parser = parser
+        self.useMapCache = useMapCache and data is None
+        self._content = content
+        self.sheet = None
+        self.notes: List[NoteRecordDTO] = []
+        self.media: List[dict] = []
+        self.mediaKeys = set()
+        self.running = True
+        self.log = []
+        # per sheet caches keyed by topic ids, cleared by clearCaches() at the end of compileSheet()
+        self.questionListCache = dict()
+        self.answerDictCache = dict()
+        self.nodeContentCache = dict()
+
+    @property
+    def content(self) -> XmindContent:
+        # the content is loaded on first access so that writers of already compiled sheets do not parse the file
+        if not self._content:
+            if self.useMapCache:
+                self._content = MapCache().load(self.file, self.xZip, parser=self.parser)
+            else:
+                self._content = loadContent(self.xZip, parser=self.parser)
+        return self._content
+
+    def compileSheet(self, sheet: XmindSheet, tag: str = '') -> CompiledSheetDTO:
+        """
+        Compiles the notes of all questions in sheet
+        :param sheet: a sheet of the compiler's content
+        :param tag: the tag of the notes, only passed through to the result
+        :return: the notes in map order together with the media they reference
+        """
+        self.sheet = sheet
+        self.notes = []
+        self.media = []
+        self.mediaKeys = set()
+        self.running = True
+        self.log = []
+        # annotate all topics once so that roles and crosslinks can be read from the nodes during the import
+        analyzeContent(self.content)
+        rootTopic = sheet.rootTopic
+        rootDict = getAnswerDict(rootTopic)
+        self.getQuestions(answerDict=rootDict, ref=rootTopic.title)
+        self.clearCaches()
+        return CompiledSheetDTO(sheetId=sheet.id, tag=tag, notes=self.notes, media=self.media, running=self.running,
+                                log=self.log)
+
+    def close(self):
+        self.xZip.close()
+
+    # calls createNotes for each answer.
+    # Inputs:
+    # answer: parent answer node of the questions to get
+    # notes: list of notes for the notes to be created from the gotten questions
+    # AnswerContent: content of parent answer in parent anki note
+    # ref: current text for reference field
+    # aId: current id for id field
+    def getQuestions(self, answerDict: dict, sortId='',
+                     answerContent='', ref="", followsBridge=False):
+        # The reference doesn't have to be edited at the roottopic
+        if answerDict['nodeTag'].parent:
+            # if the answerdict contains nothing (i.e. questions
+            # following multiple answers), just close the reference
+            if answerDict['nodeTag'].isEmpty or followsBridge:
+                ref = ref + '</li>'
+            else:
+                ref = ref + ': ' + answerContent + '</li>'
+        questionDicts = self.findQuestionDicts(answer=answerDict['nodeTag'],
+                                               ref=ref, sortId=sortId)
+        siblingQuestions = self.getQuestionListForAnswer(answerDict)
+        for qId, questionDict in enumerate(questionDicts, start=1):
+            # Update the sorting ID
+            nextSortId = updateId(previousId=sortId, idToAppend=qId)
+            if self.running:
+                # if the current question serves as a bridge to serve as
+                # reference, do not get any notes for this bridge but for
+                # questions following its answers
+                if questionDict['isBridge']:
+                    answerDicts = self.findAnswerDicts(questionDict['nodeTag'])
+                    for aId, answerDict in enumerate(answerDicts, start=1):
+                        if answerDict['nodeTag'].children:
+                            if answerDict['isAnswer']:
+                                answerContent, media = self.getNodeContent(
+                                    answerDict['nodeTag'])
+                                self.addMedia([media])
+                                answerContent = replaceSound(answerContent)
+                                newRef = ref + '<li>' + answerContent
+                            else:
+                                answerContent = ''
+                                newRef = ref
+                            self.getQuestions(answerDict=answerDict,
+                                              answerContent=answerContent,
+                                              ref=newRef,
+                                              sortId=updateId(
+                                                  previousId=nextSortId,
+                                                  idToAppend=aId),
+                                              followsBridge=True)
+                # if this is a regular question
+                else:
+                    siblings = list(map(lambda s: s['qId'], filter(
+                        lambda q: (q['qId'] != questionDict[
+                            'nodeTag'].id) and not q['isConnection'],
+                        siblingQuestions)))
+                    connections = list(map(lambda s: s['qId'], filter(
+                        lambda q: (q['qId'] != questionDict[
+                            'nodeTag'].id) and q['isConnection'],
+                        siblingQuestions)))
+                    self.addXNote(question=questionDict['nodeTag'],
+                                  ref=questionDict['ref'], sortId=nextSortId,
+                                  siblings=siblings, connections=connections)
+
+    # creates a note record for this question, and
+    # recursively calls getQuestions() to add notes following this question
+    # Inputs:
+    # question: xmind question node
+    # ref: current reference text
+    # qId: position of the question node relative to its siblings
+    def addXNote(self, question, ref, sortId, siblings=None,
+                 connections=None):
+        answerDicts = self.findAnswerDicts(question)
+        actualAnswers = list(filter(
+            lambda a: a['isAnswer'], answerDicts))
+        if len(actualAnswers) > X_MAX_ANSWERS:
+            self.running = False
+            self.log = ["""Warning:
+A Question titled "%s" has more than %s answers. Make sure every Question in your Map is followed by no more than %s Answers and try again.""" %
+                        (question.title,
+                         X_MAX_ANSWERS, X_MAX_ANSWERS)]
+            return None
+
+        if not self.running:
+            self.logDeletedNodeWarning(question=question, sortId=sortId)
+            return None
+
+        # get content of fields for the note to add for this question
+        fields, media = self.getNoteData(sortId=sortId,
+                                         question=question,
+                                         answerDicts=answerDicts,
+                                         ref=ref,
+                                         siblings=siblings,
+                                         connections=connections)
+        # one of the answers contains a hyperlink to a deleted node
+        if not self.running:
+            self.logDeletedNodeWarning(question=question, sortId=sortId)
+            return None
+        self.addMedia(media)
+
+        # add to list of notes to add
+        self.notes.append(NoteRecordDTO(questionId=question.id, fields=fields))
+
+        # add notes for questions following this note
+        questionContent = replaceSound(fields[_QUESTION_FIELD])
+        ref = ref + '<li>' + questionContent
+        for aId, answerDict in enumerate(answerDicts, start=1):
+            if answerDict['nodeTag'].children:
+                if answerDict['isAnswer']:
+                    ac = fields[list(X_FLDS.keys()).index('a' + answerDict['aId'])]
+                    answerContent = replaceSound(ac)
+                else:
+                    answerContent = ''
+                self.getQuestions(answerDict=answerDict,
+                                  answerContent=answerContent, ref=ref,
+                                  sortId=updateId(previousId=sortId,
+                                                  idToAppend=aId))
+
+    def logDeletedNodeWarning(self, question, sortId):
+        self.log = ["""Warning:
+An answer to the question "%s" (path: %s) contains a hyperlink to a deleted node. Please adjust your Concept Map and try again.""" %
+                    (self.getNodeContent(question)[
+                         0], getCoordsFromId(sortId))]
+
+    # receives a question and list of notes possibly following each
+    # answer to this question and returns a json file
+    def getXMindMeta(self, question, answerDicts, siblings,
+                     connections):
+        xMindMeta = dict()
+        xMindMeta['path'] = self.file
+        xMindMeta['sheetId'] = self.sheet.id
+        xMindMeta['questionId'] = question.id
+        xMindMeta['answers'] = []
+        answers = list(filter(lambda answerDict: answerDict['isAnswer'],
+                              answerDicts))
+
+        # get questions following each answer
+        nextQuestions = self.getNextQuestions(answerDicts)
+        for aId, answer in enumerate(answers, start=0):
+            # write each answer and its following questions into meta
+            xMindMeta['answers'].append(dict())
+            xMindMeta['answers'][aId]['answerId'] = answer[
+                'nodeTag'].id
+            xMindMeta['answers'][aId]['children'] = []
+            # the questions are missing if the answer's crosslink points to
+            # a deleted node
+            for question in nextQuestions[aId] or []:
+                xMindMeta['answers'][aId]['children'].append(
+                    question['qId'])
+        xMindMeta['nAnswers'] = len(answers)
+        xMindMeta['siblings'] = siblings
+        xMindMeta['connections'] = connections
+        xMindMeta['lastSync'] = int_time()
+        return json.dumps(xMindMeta)
+
+    def getNextQuestions(self, answerDicts: list, addCrosslinks=True,
+                         goDeeper=True):
+        """receives a list of answerDicts and returns a list of anki notes for each subtopic"""
+
+        nextQuestions = []
+        globalQuestions = []
+        bridges = list(filter(lambda answerDict: not answerDict['isAnswer'],
+                              answerDicts))
+        answers = list(filter(lambda answerDict: answerDict['isAnswer'],
+                              answerDicts))
+        for bridge in bridges:
+            globalQuestions.extend(self.getQuestionListForAnswer(bridge) or [])
+        for answer in answers:
+            # Add one new note for each question following this subTopic
+            questionListForAnswer = self.getQuestionListForAnswer(
+                answerDict=answer, globalQuestions=globalQuestions,
+                addCrosslinks=addCrosslinks, goDeeper=goDeeper)
+            nextQuestions.append(questionListForAnswer)
+        return nextQuestions
+
+    # receives an answerDict and returns a list of xmind topic ids
+    def getQuestionListForAnswer(self, answerDict: dict, globalQuestions=None,
+                                 addCrosslinks=True, goDeeper=True):
+        cacheKey = (answerDict['nodeTag'].id, addCrosslinks, goDeeper)
+        try:
+            followingQuestions, crosslinkQuestions = self.questionListCache[
+                cacheKey]
+        except KeyError:
+            followingQuestions, crosslinkQuestions = self.findQuestionLists(
+                answerDict=answerDict, addCrosslinks=addCrosslinks,
+                goDeeper=goDeeper)
+            self.questionListCache[cacheKey] = (followingQuestions,
+                                                crosslinkQuestions)
+        # the answer's crosslink points to a deleted node
+        if crosslinkQuestions is None:
+            self.running = False
+            return None
+        questionList = list(followingQuestions)
+        if globalQuestions:
+            questionList.extend(globalQuestions)
+        questionList.extend(crosslinkQuestions)
+        return questionList
+
+    # returns the questions following the answer in answerDict and the
+    # questions following the answer's crosslink, or None instead of the
+    # latter if the crosslink points to a deleted node
+    def findQuestionLists(self, answerDict: dict, addCrosslinks, goDeeper):
+        # get all nodes following the answer in answerDict, including those
+        # following a potential crosslink
+        potentialQuestions = answerDict['nodeTag'].children
+        # iterate through all questions
+        questionList = []
+        for potentialQuestion in potentialQuestions:
+            if not potentialQuestion.isEmpty:
+                # If this question contains a crosslink to another question
+                crosslinkNode = potentialQuestion.crosslinkTarget
+                if crosslinkNode and crosslinkNode.isQuestion:
+                    questionList.append(
+                        dict(qId=crosslinkNode.id, isConnection=not addCrosslinks))
+                else:
+                    questionList.append(dict(qId=potentialQuestion.id,
+                                             isConnection=not addCrosslinks))
+            else:
+                if goDeeper:
+                    nextAnswerDicts = self.findAnswerDicts(potentialQuestion)
+                    # code in brackets is for unlisting:
+                    # https://stackoverflow.com/a/952952
+                    followingQuestions = [item for sublist in
+                                          self.getNextQuestions(
+                                              answerDicts=nextAnswerDicts,
+                                              addCrosslinks=addCrosslinks,
+                                              goDeeper=False) for
+                                          item in sublist or []]
+                    questionList.extend(followingQuestions)
+        crosslinkQuestions = []
+        if answerDict['crosslink'] and addCrosslinks:
+            crosslinkNode = answerDict['nodeTag'].crosslinkTarget
+            if not crosslinkNode:
+                return questionList, None
+            crosslinkAnswerDict = getAnswerDict(crosslinkNode)
+            # Do not add crosslinks following crosslinks to avoid endless loops
+            crosslinkQuestions = self.getQuestionListForAnswer(
+                answerDict=crosslinkAnswerDict, addCrosslinks=False)
+        return questionList, crosslinkQuestions
+
+    def getNoteData(self, sortId, question, answerDicts, ref, siblings,
+                    connections):
+        """returns a list of the contents of all fields of the note for
+        question and the media contained in that note in a list"""
+
+        noteList = []
+        media = []
+
+        # Set field Reference
+        noteList.append('<ul>%s</ul>' % ref)
+
+        # Set field Question
+        qtContent, qtMedia = self.getNodeContent(question)
+        noteList.append(qtContent)
+        media.append(qtMedia)
+
+        # Set Answer fields
+        aId = 0
+        for answerDict in answerDicts:
+            if answerDict['isAnswer']:
+                aId += 1
+                # noinspection PyTypeChecker
+                anContent, anMedia = self.getNodeContent(answerDict['nodeTag'])
+                noteList.append(anContent)
+                media.append(anMedia)
+                answerDict['aId'] = str(aId)
+
+        # noinspection PyShadowingNames
+        for i in range(aId, X_MAX_ANSWERS):
+            noteList.append('')
+
+        # set field ID
+        noteList.append(sortId)
+
+        # set field Meta
+        meta = self.getXMindMeta(question=question, answerDicts=answerDicts,
+                                 siblings=siblings, connections=connections)
+        noteList.append(meta)
+
+        return noteList, media
+
+    # receives a question node and returns a list of dictionaries containing the
+    # subtopics, whether the subtopics contain an answer or not and whether they
+    # contain a crosslink or not
+    def findAnswerDicts(self, question):
+        try:
+            return self.answerDictCache[question.id]
+        except KeyError:
+            pass
+        answerDicts = list()
+        for childNode in question.children:
+            answerDict = getAnswerDict(childNode)
+            answerDicts.append(answerDict)
+        self.answerDictCache[question.id] = answerDicts
+        return answerDicts
+
+    def getNodeContent(self, node):
+        """returns the content and media of a node, each node is only rendered
+        once per sheet"""
+        try:
+            return self.nodeContentCache[node.id]
+        except KeyError:
+            nodeContent = getNodeContent(topicsById=self.content.topicsById, node=node)
+            self.nodeContentCache[node.id] = nodeContent
+            return nodeContent
+
+    def clearCaches(self):
+        self.questionListCache.clear()
+        self.answerDictCache.clear()
+        self.nodeContentCache.clear()
+
+    def addMedia(self, media):
+        """remembers the images and files in media that were not referenced
+        before"""
+        for files in media:
+            key = (files['image'], files['media'])
+            if any(key) and key not in self.mediaKeys:
+                self.mediaKeys.add(key)
+                self.media.append(files)
+
+    # receives an answer node and returns all questions following this answer
+    # including questions following multiple topics as dictionaries of a
+    # question node and its corresponding reference
+    def findQuestionDicts(self, answer, sortId, ref=''):
+        followRels = answer.children
+        questionDicts = []
+        for followRel in followRels:
+            crosslink = followRel.crosslink
+            if len(followRel.children) == 0:
+                # stop and warn if no nodes follow the question
+                if not crosslink:
+                    self.running = False
+                    self.log = ["""Warning:
+A Question titled "%s" (Path %s) is missing answers. Please adjust your Concept Map and try again.""" %
+                                (self.getNodeContent(followRel)[0],
+                                 getCoordsFromId(sortId))]
+            else:
+                questionDict = self.getQuestionDict(subTopic=followRel, ref=ref,
+                                                    isBridge=followRel.isBridge,
+                                                    crosslink=crosslink)
+
+                questionDicts.append(questionDict)
+        return questionDicts
+
+    def getQuestionDict(self, subTopic, ref, isBridge, crosslink):
+        return dict(nodeTag=subTopic, ref=ref, isBridge=isBridge,
+                    crosslink=crosslink)
@@ -0,0 +1,58 @@
+"""Compact representation of the topics of an xmind sheet"""
+from typing import Iterable, Optional
+
+# roles of nodes in a concept map, concepts are answers and relationships are questions
+CONCEPT = 'concept'
+RELATIONSHIP = 'relationship'
+
+
+class MapNode:
+    """
+    A topic of an xmind sheet with everything the importer and syncer read from it precomputed, so that walking the
+    map only requires attribute reads
+    """
+    __slots__ = ('id', 'title', 'image', 'hyperlink', 'crosslink', 'children', 'parent', 'depth', 'role', 'isEmpty',
+                 'crosslinkTarget')
+
+    def __init__(self, id: str, title: str = '', image: Optional[str] = None, hyperlink: Optional[str] = None,
+                 parent: Optional['MapNode'] = None):
+        self.id = id
+        self.title = title
+        # value of the image's xhtml:src attribute, e.g. 'xap:attachments/1234.png'
+        self.image = image
+        # value of the topic's xlink:href attribute
+        self.hyperlink = hyperlink
+        # id of the topic the hyperlink points to if it is a link to another topic
+        self.crosslink = hyperlink[7:] if hyperlink and hyperlink.startswith('xmind:#') else None
+        # attached subtopics in map order, detached topics are not included. Filled as a list while the sheet is read
+        # and frozen to a tuple by freezeNodes()
+        self.children = []
+        self.parent = parent
+        # number of edges between the sheet's root topic and this node
+        self.depth = parent.depth + 1 if parent else 0
+        # annotations set by sheetanalyzer.analyzeSheet()
+        self.role: Optional[str] = None
+        self.isEmpty: Optional[bool] = None
+        self.crosslinkTarget: Optional['MapNode'] = None
+
+    @property
+    def isQuestion(self) -> bool:
+        return self.role == RELATIONSHIP
+
+    @property
+    def isBridge(self) -> bool:
+        """
+        Whether this node is an empty question that only groups the questions following its answers
+        """
+        return self.role == RELATIONSHIP and self.isEmpty
+
+    def __repr__(self):
+        return 'MapNode(%r, %r)' % (self.id, self.title)
+
+
+def freezeNodes(nodes: Iterable[MapNode]) -> None:
+    """
+    Turns the children lists of the nodes of a completely read sheet into tuples
+    """
+    for node in nodes:
+        node.children = tuple(node.children)
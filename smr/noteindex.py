@@ -0,0 +1,115 @@
+"""Index of the SMR notes in a collection by the ids of the sheets and nodes they were imported from"""
+import json
+from typing import Iterable, Sequence, Tuple
+
+from anki.collection import Collection
+from anki.utils import ids2str, split_fields
+
+from .consts import X_FLDS_META_INDEX, X_MODEL_NAME
+
+# The index lives in tables of the collection's database so that it is committed and rolled back together with the
+# notes it describes. Notes that were deleted without updating the index are filtered out by joining the notes table.
+# Each entry keeps the modification time of its note so that notes changed by a sync can be found without reading all
+# notes.
+X_INDEX_TABLES = ('smr_notes', 'smr_answers', 'smr_children')
+X_INDEX_SCHEMA = (
+    """create table if not exists smr_notes (
+        nid integer primary key,
+        path text not null,
+        sheet_id text not null,
+        question_id text not null,
+        mod integer
+    )""",
+    "create index if not exists ix_smr_notes_path on smr_notes (path)",
+    "create index if not exists ix_smr_notes_sheet_id on smr_notes (sheet_id)",
+    "create index if not exists ix_smr_notes_question_id on smr_notes (question_id)",
+    """create table if not exists smr_answers (
+        nid integer not null,
+        ord integer not null,
+        answer_id text not null,
+        primary key (nid, ord)
+    ) without rowid""",
+    "create index if not exists ix_smr_answers_answer_id on smr_answers (answer_id)",
+    """create table if not exists smr_children (
+        nid integer not null,
+        ord integer not null,
+        question_id text not null,
+        primary key (nid, ord, question_id)
+    ) without rowid""",
+    "create index if not exists ix_smr_children_question_id on smr_children (question_id)",
+)
+
+
+def ensureIndex(col: Collection) -> None:
+    """
+    Creates the index and fills it with the collection's SMR notes unless the collection already has one
+    """
+    if col.db.scalar("select count() from sqlite_master where type = 'table' and name in (%s)" % ', '.join(
+            "'%s'" % table for table in X_INDEX_TABLES)) < len(X_INDEX_TABLES) or not col.db.scalar(
+            "select count() from pragma_table_info('smr_notes') where name = 'mod'"):
+        rebuildIndex(col)
+
+
+def rebuildIndex(col: Collection) -> int:
+    """
+    Replaces the index with entries for all SMR notes in the collection, e.g. after the collection was synchronized
+    :return: the number of indexed notes
+    """
+    for table in X_INDEX_TABLES:
+        col.db.execute('drop table if exists ' + table)
+    for statement in X_INDEX_SCHEMA:
+        col.db.execute(statement)
+    mid = col.models.id_for_name(X_MODEL_NAME)
+    if not mid:
+        return 0
+    return indexNotes(col, col.db.all('select id, flds from notes where mid = ?', mid))
+
+
+def updateIndex(col: Collection) -> int:
+    """
+    Indexes the SMR notes that were added or modified since they were last indexed and removes the entries of deleted
+    notes, e.g. after the collection was synchronized
+    :return: the number of added, replaced or removed entries
+    """
+    mid = col.models.id_for_name(X_MODEL_NAME)
+    removedIds = col.db.list('select nid from smr_notes where nid not in (select id from notes where mid = ?)', mid)
+    changedNotes = col.db.all('''select n.id, n.flds from notes n left join smr_notes i on i.nid = n.id
+        where n.mid = ? and (i.mod is null or i.mod != n.mod)''', mid)
+    if removedIds:
+        unindexNotes(col, removedIds)
+    if changedNotes:
+        indexNotes(col, changedNotes)
+    return len(removedIds) + len(changedNotes)
+
+
+def indexNotes(col: Collection, notes: Sequence[Tuple[int, str]]) -> int:
+    """
+    Adds or replaces the entries of notes, the notes need to be in the collection's notes table
+    :param notes: tuples of the ids and joined fields of the notes to index
+    :return: the number of indexed notes, notes without a valid meta field are not indexed
+    """
+    unindexNotes(col, [nid for nid, _ in notes])
+    noteRows = []
+    answerRows = []
+    childRows = []
+    for nid, flds in notes:
+        try:
+            meta = json.loads(split_fields(flds)[X_FLDS_META_INDEX])
+            noteRow = (nid, meta['path'], meta['sheetId'], meta['questionId'], nid)
+            answers = meta['answers']
+        except (IndexError, KeyError, TypeError, ValueError):
+            continue
+        noteRows.append(noteRow)
+        for ord, answer in enumerate(answers):
+            answerRows.append((nid, ord, answer['answerId']))
+            childRows.extend((nid, ord, qId) for qId in answer['children'])
+    col.db.executemany('insert into smr_notes values (?, ?, ?, ?, (select mod from notes where id = ?))', noteRows)
+    col.db.executemany('insert into smr_answers values (?, ?, ?)', answerRows)
+    col.db.executemany('insert or ignore into smr_children values (?, ?, ?)', childRows)
+    return len(noteRows)
+
+
+def unindexNotes(col: Collection, nids: Iterable[int]) -> None:
+    nids = ids2str(nids)
+    for table in X_INDEX_TABLES:
+        col.db.execute('delete from %s where nid in %s' % (table, nids))
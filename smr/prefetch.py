@@ -0,0 +1,122 @@
+"""Selection of the next SMR card on a worker thread while the user looks at the current one"""
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from anki.cards import Card
+
+from .duequeues import getDueQueues
+from .reviewgraph import getReviewGraph
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smr-prefetch')
+_prefetch = None
+# the review graph and due queues whose due notes were added to the graph with all notes reachable from them
+_reachedQueues = None
+
+
+class Prefetch:
+    """
+    The card that follows a card in SMR mode, selected on a worker thread under the assumption that the card is not
+    due anymore once it is answered. The selection runs on a copy of the scheduler so that it does not change the
+    queues and counts the reviewer shows, and it reads the due queues with the card left out while holding their lock,
+    so that the answer waits for it before it updates them. It is only used if the answer changed nothing but the
+    cards of the card's note and these cards are due as assumed when the next card is needed. Everything the
+    selection needs from the collection is loaded into the review graph beforehand, the worker does not touch the
+    collection, and the card is only loaded on the main thread once it is used.
+    """
+
+    def __init__(self, sched, learnHistory: List[list], card: Card):
+        global _reachedQueues
+        self.cardId = card.id
+        self.nid = card.nid
+        self.graph = getReviewGraph(sched.col, sched._lrnDids[0])
+        self.dueQueues = getDueQueues(sched)
+        # the notes of the due queues only change with the notes of the answered cards, which were selected from the
+        # graph, so all due notes only need to be added for new graphs and queues
+        if _reachedQueues != (self.graph, self.dueQueues):
+            self.graph.addReachableNotes(
+                [nid for nid, _ in learnHistory] + list(self.dueQueues.revNids) + list(self.dueQueues.newNids) +
+                [self.dueQueues.nidByCid[cid] for cid in self.dueQueues.lrn])
+            _reachedQueues = (self.graph, self.dueQueues)
+        else:
+            self.graph.addReachableNotes([card.nid])
+        self.graph.descendantIndex()
+        self.sched = copy.copy(sched)
+        self.sched.smrGraph = self.graph
+        self.version = self.dueQueues.version
+        self.learnHistory = learnHistory
+        self.selectedAt = None
+        # whether each card of the card's note was assumed to be due
+        self.noteCards = None
+        self.answerId: Optional[int] = None
+        self.card: Optional[Card] = None
+        self.future = _executor.submit(self.select)
+
+    def select(self) -> None:
+        with self.dueQueues.lock:
+            self.selectedAt = time.time()
+            self.learnHistory = [[nid, list(cids)] for nid, cids in self.learnHistory]
+            dueCids = self.dueQueues.dueCids(self.selectedAt, excludedCid=self.cardId)
+            self.noteCards = {cid: cid in dueCids for cid, _ in self.graph.cards[self.graph.node(self.nid)]}
+            self.answerId = self.sched.getNextSMRAnswer(self.learnHistory, dueQueues=self.dueQueues,
+                                                        now=self.selectedAt, excludedCid=self.cardId)
+
+    def isValid(self, sched, cardId: int, now: float) -> bool:
+        """
+        Whether the selection is still valid after the card with id cardId was answered
+        """
+        try:
+            self.future.result()
+        except Exception:
+            return False
+        dueQueues = getDueQueues(sched)
+        if self.cardId != cardId or dueQueues is not self.dueQueues or \
+                getReviewGraph(sched.col, sched._lrnDids[0]) is not self.graph:
+            return False
+        # the queues may only have been updated with the answered card's note
+        if dueQueues.version > self.version + 1:
+            return False
+        dueCids = dueQueues.dueCids(now)
+        if any((cid in dueCids) != isDue for cid, isDue in self.noteCards.items()):
+            return False
+        # learning cards of other notes may have become due since the selection
+        return not any(self.selectedAt <= due < now and dueQueues.nidByCid[cid] != self.nid
+                       for cid, due in dueQueues.lrn.items())
+
+
+def startPrefetch(sched, learnHistory: List[list], card: Card) -> None:
+    """
+    Starts selecting the card that follows card in learnHistory, discards any previous selection
+    """
+    global _prefetch
+    discardPrefetch()
+    _prefetch = Prefetch(sched=sched, learnHistory=learnHistory, card=card)
+
+
+def takePrefetch(sched, cardId: int) -> Optional[Prefetch]:
+    """
+    Returns the selection that was started for the card with id cardId with its card if it is still valid and sets
+    sched's queues like the selection, waits for the worker if it is not done yet
+    """
+    global _prefetch
+    prefetch, _prefetch = _prefetch, None
+    if not prefetch:
+        return None
+    now = time.time()
+    if not prefetch.isValid(sched, cardId=cardId, now=now):
+        return None
+    sched.smrGraph = prefetch.graph
+    sched.setSMRQueues(getDueQueues(sched), now)
+    prefetch.card = sched.col.get_card(prefetch.answerId) if prefetch.answerId else None
+    return prefetch
+
+
+def discardPrefetch() -> None:
+    """
+    Drops the current selection, waits for the worker so that it does not change the review graph concurrently
+    """
+    global _prefetch
+    prefetch, _prefetch = _prefetch, None
+    if prefetch:
+        prefetch.future.exception()
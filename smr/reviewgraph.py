@@ -0,0 +1,301 @@
+"""In-memory graph of the questions in SMR decks for selecting the next card during reviews"""
+import copy
+import json
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from anki.collection import Collection
+from anki.utils import ids2str, split_fields
+
+from .consts import X_FLDS_META_INDEX
+
+_reviewGraphs = dict()
+
+
+class ReviewGraph:
+    """
+    Notes of the sheets with cards in a deck and their relations. Each note is a node, its note id, sort id, cards and
+    the questions following its answers, its siblings and its connections are stored in lists indexed by node so that
+    selecting the next card neither parses meta fields nor looks up notes. The graph is built once for all notes with
+    the same question ids as the notes of the deck's sheets, notes of other sheets, e.g. of crosslinked questions, are
+    added when they are first referenced.
+    """
+
+    def __init__(self, col: Collection, did: int):
+        self.col = col
+        self.did = did
+        self.nids: List[int] = []
+        self.sortIds: List[str] = []
+        # card ids and ords of each node's cards, in the order of their ids
+        self.cards: List[Tuple[Tuple[int, int], ...]] = []
+        # question ids of the questions following each answer of each node
+        self.children: List[Tuple[Tuple[str, ...], ...]] = []
+        self.siblings: List[Tuple[str, ...]] = []
+        self.connections: List[Tuple[str, ...]] = []
+        self.nodeByNid: Dict[int, int] = dict()
+        self.ordByCid: Dict[int, int] = dict()
+        # nodes of the notes with each question id, in the order of their note ids
+        self.nodesByQId: Dict[str, List[int]] = dict()
+        self._descendantIndex: Optional[DescendantIndex] = None
+        # number of nodes whose questions were resolved by addReachableNotes()
+        self._reachedNodes = 0
+        self.addNotes(col.db.list("""
+            select q.nid from smr_notes q where q.question_id in (
+                select s.question_id from smr_notes s where s.sheet_id in (
+                    select i.sheet_id from cards c join smr_notes i on i.nid = c.nid where c.did = ?))""", did))
+
+    def addNotes(self, nids: Iterable[int]) -> None:
+        """
+        Adds nodes for the notes with ids nids, all notes with the same question ids must be added at once
+        """
+        nids = ids2str(nids)
+        firstNode = len(self.nids)
+        for nid, sortId, flds in self.col.db.execute(
+                "select id, sfld, flds from notes where id in %s order by id" % nids):
+            meta = json.loads(split_fields(flds)[X_FLDS_META_INDEX])
+            self.nodeByNid[nid] = len(self.nids)
+            self.nodesByQId.setdefault(meta['questionId'], []).append(len(self.nids))
+            self.nids.append(nid)
+            self.sortIds.append(str(sortId))
+            self.children.append(tuple(tuple(a['children']) for a in meta['answers']))
+            self.siblings.append(tuple(meta['siblings']))
+            self.connections.append(tuple(meta['connections']))
+        cards = dict()
+        for nid, cid, ord in self.col.db.execute(
+                "select nid, id, ord from cards where nid in %s order by nid, id" % nids):
+            cards.setdefault(nid, []).append((cid, ord))
+            self.ordByCid[cid] = ord
+        self.cards.extend(tuple(cards.get(nid, ())) for nid in self.nids[firstNode:])
+
+    def node(self, nid: int) -> int:
+        """
+        Returns the node of the note with id nid, adding it and the notes with the same question id if necessary
+        """
+        if nid not in self.nodeByNid:
+            self.addNotes(self.col.db.list("""
+                select q.nid from smr_notes q join smr_notes i on i.question_id = q.question_id
+                where i.nid = ?""", nid))
+        return self.nodeByNid[nid]
+
+    def nodesOfQuestion(self, qId: str) -> List[int]:
+        if qId not in self.nodesByQId:
+            self.addNotes(self.col.db.list("select nid from smr_notes where question_id = ?", qId))
+            self.nodesByQId.setdefault(qId, [])
+        return self.nodesByQId[qId]
+
+    def nidsOfQuestions(self, qIds: Iterable[str]) -> List[int]:
+        """
+        Returns the ids of the notes of the questions with ids qIds like utils.getNotesFromQIds()
+        """
+        return [self.nids[n] for qId in qIds for n in self.nodesOfQuestion(qId)]
+
+    def cardOrds(self, nid: int, cids=None, exclude=False) -> List[int]:
+        """
+        Returns the ords of the note's cards in the order of their ids, only of the cards with ids in cids or, if
+        exclude is set, only of the other cards if cids is given
+        """
+        cards = self.cards[self.node(nid)]
+        if cids is None:
+            return [ord for _, ord in cards]
+        cids = set(cids)
+        return [ord for cid, ord in cards if (cid in cids) != exclude]
+
+    def dueAnswersToNotes(self, nids: Iterable[int], dueCids) -> Dict[int, List[dict]]:
+        """
+        Returns the ids and ords of each note's cards with ids in dueCids in the order of their ids
+        """
+        return {nid: [dict(cId=cid, ord=ord) for cid, ord in self.cards[self.node(nid)] if cid in dueCids]
+                for nid in nids}
+
+    def addReachableNotes(self, nids: Iterable[int] = ()) -> None:
+        """
+        Adds the notes with ids nids and all notes whose questions can be reached from the graph's notes through
+        children, siblings and connections, afterwards selecting cards from these notes does not query the collection
+        """
+        for nid in nids:
+            self.node(nid)
+        # resolving the questions may add nodes to the graph
+        while self._reachedNodes < len(self.nids):
+            node = self._reachedNodes
+            for qIds in self.children[node] + (self.siblings[node], self.connections[node]):
+                for qId in qIds:
+                    self.nodesOfQuestion(qId)
+            self._reachedNodes += 1
+
+    def childNodes(self, node: int) -> List[int]:
+        """
+        Returns the nodes of the questions following the node's answers like the scheduler selects them
+        """
+        return [child for answer in self.children[node] for qId in answer for child in self.nodesOfQuestion(qId)[:1]]
+
+    def descendantIndex(self) -> 'DescendantIndex':
+        if self._descendantIndex is None:
+            self._descendantIndex = DescendantIndex(self)
+        return self._descendantIndex
+
+
+class DescendantIndex:
+    """
+    Pre-order numbering of the nodes of a review graph along the questions following the nodes' answers. The
+    descendants of a node in the spanning forest of the numbering have the positions up to its exit position. A node is
+    closed if no question following any of these descendants lies outside of this range, so the questions that can be
+    reached from a closed node are exactly its descendants. Nodes that are added to the graph later are not numbered.
+    """
+
+    def __init__(self, graph: ReviewGraph):
+        children = []
+        node = 0
+        # resolving the children may add nodes to the graph
+        while node < len(graph.nids):
+            children.append(graph.childNodes(node))
+            node += 1
+        nNodes = len(children)
+        hasParent = [False] * nNodes
+        for nodeChildren in children:
+            for child in nodeChildren:
+                hasParent[child] = True
+        self.entry = array('l', [-1] * nNodes)
+        self.exit = array('l', [-1] * nNodes)
+        self.order = array('l')
+        treeChildren = [[] for _ in range(nNodes)]
+        # roots first so that the spanning forest follows the maps, then nodes on cycles without roots
+        for root in [n for n in range(nNodes) if not hasParent[n]] + list(range(nNodes)):
+            if self.entry[root] != -1:
+                continue
+            self.entry[root] = len(self.order)
+            self.order.append(root)
+            stack = [(root, iter(children[root]))]
+            while stack:
+                node, nodeChildren = stack[-1]
+                for child in nodeChildren:
+                    if self.entry[child] == -1:
+                        self.entry[child] = len(self.order)
+                        self.order.append(child)
+                        treeChildren[node].append(child)
+                        stack.append((child, iter(children[child])))
+                        break
+                else:
+                    self.exit[node] = len(self.order) - 1
+                    stack.pop()
+        # lowest and highest position of the questions following the descendants of each node
+        low = array('l', self.entry)
+        high = array('l', self.entry)
+        for node in reversed(self.order):
+            for child in children[node]:
+                low[node] = min(low[node], self.entry[child])
+                high[node] = max(high[node], self.entry[child])
+            for child in treeChildren[node]:
+                low[node] = min(low[node], low[child])
+                high[node] = max(high[node], high[child])
+        self.closed = bytearray(low[n] >= self.entry[n] and high[n] <= self.exit[n] for n in range(nNodes))
+
+    def dueCounts(self, graph: ReviewGraph, nids: Iterable[int]) -> 'DueCounts':
+        return DueCounts(index=self, graph=graph, nids=nids)
+
+
+class DueCounts:
+    """
+    Numbers of due cards of the nodes of a descendant index in a Fenwick tree over their pre-order positions. The
+    counts are updated card by card while cards enter and leave the due queues, so that both updates and queries take
+    logarithmic time in the number of nodes.
+    """
+
+    def __init__(self, index: DescendantIndex, graph: ReviewGraph, nids: Iterable[int]):
+        """
+        :param nids: the note id of each due card
+        """
+        self.index = index
+        self.graph = graph
+        self.tree = array('l', [0] * (len(index.order) + 1))
+        for nid in nids:
+            position = self.position(nid)
+            if position is not None:
+                self.tree[position + 1] += 1
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+
+    def copy(self) -> 'DueCounts':
+        dueCounts = copy.copy(self)
+        dueCounts.tree = array('l', self.tree)
+        return dueCounts
+
+    def position(self, nid: int) -> Optional[int]:
+        node = self.graph.nodeByNid.get(nid)
+        if node is None or node >= len(self.index.entry):
+            return None
+        return self.index.entry[node]
+
+    def add(self, nid: int, count: int) -> None:
+        """
+        Adds count to the number of due cards of the note with id nid, notes that are not numbered by the index are
+        ignored
+        """
+        position = self.position(nid)
+        if position is None:
+            return
+        i = position + 1
+        while i < len(self.tree):
+            self.tree[i] += count
+            i += i & -i
+
+    def countBefore(self, end: int) -> int:
+        """
+        Returns the number of due cards of the nodes at the positions before end
+        """
+        total = 0
+        while end > 0:
+            total += self.tree[end]
+            end -= end & -end
+        return total
+
+    def mayHaveDueDescendants(self, node: int) -> bool:
+        """
+        Whether the node or any question that can be reached from it may have due cards, only false if that is certain
+        """
+        if node >= len(self.index.closed) or not self.index.closed[node]:
+            return True
+        return self.countBefore(self.index.exit[node] + 1) > self.countBefore(self.index.entry[node])
+
+    def firstDueDescendant(self, node: int) -> Optional[int]:
+        """
+        Returns the first node in map order among the node and its descendants in the index that has due cards or None
+        if none of them has any
+        """
+        if node >= len(self.index.entry):
+            return None
+        # find the shortest prefix with one more due card than the prefix before the node
+        target = self.countBefore(self.index.entry[node]) + 1
+        end = 0
+        step = 1 << (len(self.tree) - 1).bit_length()
+        while step:
+            if end + step < len(self.tree) and self.tree[end + step] < target:
+                end += step
+                target -= self.tree[end]
+            step >>= 1
+        if end > self.index.exit[node]:
+            return None
+        return self.index.order[end]
+
+
+def getReviewGraph(col: Collection, did: int) -> ReviewGraph:
+    """
+    Returns the review graph of the deck with id did, builds it if there is none since the last invalidation
+    """
+    # anki's scheduler holds a proxy of the collection, the graphs are stored with the proxy so that the same graph is
+    # found for both
+    col = col.weakref()
+    key = (col.path, did)
+    graph = _reviewGraphs.get(key)
+    if not graph or graph.col is not col:
+        graph = ReviewGraph(col=col, did=did)
+        _reviewGraphs[key] = graph
+    return graph
+
+
+def invalidateReviewGraphs() -> None:
+    """
+    Drops all review graphs, needs to be called whenever SMR notes are imported, synchronized or edited
+    """
+    _reviewGraphs.clear()
@@ -0,0 +1,27 @@
+"""Single pass annotation of the topics of xmind sheets with the roles they play in the concept map"""
+from .mapnode import CONCEPT, RELATIONSHIP
+
+
+def analyzeSheet(content, sheet) -> None:
+    """
+    Annotates every topic of the sheet with its role, whether it is empty and the topic its crosslink points to. The
+    level of a topic is its depth, topics on odd levels are relationships (questions), all others are concepts
+    (answers). Sheets are analyzed only once, so the annotations can be reused for the whole import.
+    :param content: the XmindContent the sheet belongs to, used for resolving crosslinks
+    :param sheet: the XmindSheet to analyze
+    """
+    if sheet.analyzed:
+        return
+    for node in sheet.topics:
+        node.role = RELATIONSHIP if node.depth % 2 == 1 else CONCEPT
+        node.isEmpty = not (node.title or node.image or node.hyperlink)
+        node.crosslinkTarget = content.getTopic(node.crosslink) if node.crosslink else None
+    sheet.analyzed = True
+
+
+def analyzeContent(content) -> None:
+    """
+    Analyzes all sheets of the content that were not analyzed yet, crosslinks may point to topics on other sheets
+    """
+    for sheet in content.sheets:
+        analyzeSheet(content, sheet)
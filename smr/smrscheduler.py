@@ -0,0 +1,327 @@
+"""SMR mode of anki's v2 scheduler, selects the next card by following the questions of the last studied note"""
+
+import random
+import time
+from typing import cast
+
+from anki import scheduler
+from anki.cards import CardId
+
+from .duequeues import CardQueue, getDueQueues
+from .reviewgraph import getReviewGraph
+
+
+def setSMRQueues(self, dueQueues, now, excludedCid=None):
+    """sets the scheduler's queues and counts to the cards of dueQueues that
+    are due at now and returns the ids of their notes, leaves out the card
+    with id excludedCid in the due cards and note ids. Only the learning
+    queue is collected, it holds the few cards in learning and anki pushes
+    cards onto it, the other queues and note ids are views that dueQueues
+    keeps up to date"""
+    self._lrnQueue = [cast(tuple[int, CardId], e)
+                      for e in dueQueues.lrnQueue(now, excludedCid)]
+    self.lrnCount = len(self._lrnQueue)
+
+    self._revQueue = CardQueue(dueQueues.rev)
+    self.revCount = len(self._revQueue)
+
+    self._newQueue = CardQueue(dueQueues.new)
+    self.newCount = len(self._newQueue)
+
+    self.smrDueCids = dueQueues.dueCids(now, excludedCid)
+
+    nidList = dict()
+    nidList['lrn'] = dueQueues.lrnNids(now, excludedCid)
+    nidList['rev'] = dueQueues.revNoteIds(excludedCid)
+    nidList['new'] = dueQueues.newNoteIds(excludedCid)
+    return nidList
+
+
+scheduler.v2.Scheduler.setSMRQueues = setSMRQueues
+
+
+def getNextSMRCard(self, learnHistory):
+    """returns the next card for the learn history"""
+    self.smrGraph = getReviewGraph(self.col, self._lrnDids[0])
+    answerId = self.getNextSMRAnswer(learnHistory, dueQueues=getDueQueues(self),
+                                     now=time.time())
+    return self.col.get_card(answerId) if answerId else None
+
+
+scheduler.v2.Scheduler.getNextSMRCard = getNextSMRCard
+
+
+def getNextSMRAnswer(self, learnHistory, dueQueues, now, excludedCid=None):
+    """returns the id of the next card for the learn history with the cards
+    of dueQueues that are due at now except the card with id excludedCid.
+    The card is selected from self.smrGraph without querying the collection,
+    so this can run on a worker thread if all notes it may reach were added
+    to the graph"""
+    nidList = self.setSMRQueues(dueQueues, now, excludedCid)
+    dueAnswers = self.smrDueCids
+    self.smrDueQueues = dueQueues
+
+    # notes whose due answers or children were looked up during this
+    # selection, none of them can have due answers since the selection would
+    # have ended otherwise
+    self.smrVisitedNids = set()
+    self.smrExpandedNids = set()
+    # go back in the history until a note is found that is followed by due
+    # questions
+    while len(learnHistory) > 0:
+        answerId = self.getNextSMRCardAfter(lastNoteLst=learnHistory[-1],
+                                            dueAnswers=dueAnswers,
+                                            nidList=nidList)
+        if answerId:
+            return answerId
+        # If the last note did not have any further questions, remove the
+        # last Item from the history and search again
+        del learnHistory[-1]
+
+    # if the user starts studying or a branch was completely studied
+    if len(learnHistory) == 0:
+        # get shortest sortID among available notes, the length of a note's
+        # sort id is its depth in the map
+        allNids = nidList['lrn'] | nidList['rev'] | nidList['new']
+        if len(allNids) == 0:
+            return None
+        depths = {nid: len(self.smrGraph.sortIds[self.smrGraph.node(nid)])
+                  for nid in allNids}
+        minIDLength = min(depths.values())
+        startingNotes = sorted(
+            nid for nid in nidList['lrn'] if depths[nid] == minIDLength)
+        if len(startingNotes) == 0:
+            startingNotes = sorted(
+                nid for nid in nidList['rev'] if depths[nid] == minIDLength)
+        if len(startingNotes) == 0:
+            startingNotes = sorted(
+                nid for nid in nidList['new'] if depths[nid] == minIDLength)
+
+        startingNote = random.choice(startingNotes)
+
+        return self.getNextAnswer(startingNote, 0)
+
+
+scheduler.v2.Scheduler.getNextSMRAnswer = getNextSMRAnswer
+
+
+def getNextSMRCardAfter(self, lastNoteLst, dueAnswers, nidList):
+    """returns the id of the next card after the note in the entry lastNoteLst
+    of the learn history or None if no questions around that note are due"""
+    dueAw2Note = self.smrGraph.dueAnswersToNotes(
+        [lastNoteLst[0]], dueAnswers)[lastNoteLst[0]]
+    awOrds = list(map(lambda t: t['ord'], dueAw2Note))
+
+    lastNode = self.smrGraph.node(lastNoteLst[0])
+    lstCrdOrd = self.smrGraph.ordByCid[lastNoteLst[1][-1]]
+
+    # if that note has further due answers that follow it, return the next
+    # Answer
+    if len(dueAw2Note) > 0 and max(awOrds) > lstCrdOrd:
+        return self.getNextAnswer(lastNoteLst[0], lstCrdOrd + 1)
+
+    # get Children of the answers that were answered for the last note
+    lstCrds = list(map(lambda o: dict(ord=o), self.smrGraph.cardOrds(
+        lastNoteLst[0], cids=lastNoteLst[1])))
+    nextNotes = self.getCardData(dueAnswers=dueAnswers, cards=lstCrds,
+                                 node=lastNode)
+
+    # if any of these children have due answers, return their first due answer
+    if len(nextNotes) > 0:
+        nextNote = self.getUrgentNote(nextNotes, nidList)
+        return self.getNextAnswer(nextNote, 0)
+
+    # check whether children of these children have due answers
+    answerFurtherDown = self.getAnswerFurtherDown(notes=nextNotes,
+                                                  dueAnswers=dueAnswers,
+                                                  nidList=nidList)
+    if answerFurtherDown:
+        return answerFurtherDown
+
+    # get Children of answers that were not answered in the last note
+    skippedCards = list(map(lambda o: dict(ord=o), self.smrGraph.cardOrds(
+        lastNoteLst[0], cids=lastNoteLst[1], exclude=True)))
+    nextNotes = self.getCardData(dueAnswers=dueAnswers, cards=skippedCards,
+                                 node=lastNode)
+    # if any of these children have due answers, return their first due answer
+    if len(nextNotes) > 0:
+        nextNote = self.getUrgentNote(nextNotes, nidList)
+        return self.getNextAnswer(nextNote, 0)
+
+    # check whether children of these children have due answers
+    answerFurtherDown = self.getAnswerFurtherDown(notes=nextNotes,
+                                                  dueAnswers=dueAnswers,
+                                                  nidList=nidList)
+    if answerFurtherDown:
+        return answerFurtherDown
+
+    # if no children nor children of children are due, check whether a sibling
+    # question is due and return it if necessary
+    dueSiblingNotes = []
+    siblings = []
+    siblingNids = self.smrGraph.nidsOfQuestions(self.smrGraph.siblings[lastNode])
+    for nId, dueCards in zip(siblingNids, self.getDueCards(
+            nIds=siblingNids, dueAnswers=dueAnswers)):
+        siblings.append(dict(nid=nId, dueCards=dueCards))
+        if len(siblings[-1]['dueCards']) > 0:
+            dueSiblingNotes.append(
+                dict(dueCards=siblings[-1]['dueCards'], nId=nId))
+
+    if len(dueSiblingNotes) > 0:
+        nextNote = self.getUrgentNote(dueSiblingNotes, nidList)
+        return self.getNextAnswer(nid=nextNote, aId=0)
+
+    # if no siblings are due, check whether connections are due and return them
+    # if necessary
+    connections, dueConnectionNotes = self.getDueConnectionNotes(
+        dueAnswers=dueAnswers, node=lastNode)
+
+    if len(dueConnectionNotes) > 0:
+        nextNote = self.getUrgentNote(dueConnectionNotes, nidList)
+        return self.getNextAnswer(nid=nextNote, aId=0)
+
+    nxtLvlConnections = []
+    dueNxtLvlConnectionNotes = []
+    # Also check whether connections of connections have due questions
+    for connection in connections:
+        nLCons, dNLConNts = self.getDueConnectionNotes(
+            dueAnswers=dueAnswers, node=self.smrGraph.node(connection['nid']))
+        nxtLvlConnections.extend(nLCons)
+        dueNxtLvlConnectionNotes.extend(dNLConNts)
+    if len(dueNxtLvlConnectionNotes) > 0:
+        nextNote = self.getUrgentNote(dueNxtLvlConnectionNotes, nidList)
+        return self.getNextAnswer(nid=nextNote, aId=0)
+    return None
+
+
+scheduler.v2.Scheduler.getNextSMRCardAfter = getNextSMRCardAfter
+
+
+def getDueCards(self, nIds, dueAnswers):
+    """returns the due answers to each of the notes, notes that were already
+    visited during the current selection, including earlier occurrences in
+    nIds, do not have any"""
+    dueCardsByNid = self.smrGraph.dueAnswersToNotes(
+        [nId for nId in nIds if nId not in self.smrVisitedNids], dueAnswers)
+    dueCards = []
+    for nId in nIds:
+        if nId in self.smrVisitedNids:
+            dueCards.append([])
+        else:
+            self.smrVisitedNids.add(nId)
+            dueCards.append(dueCardsByNid[nId])
+    return dueCards
+
+
+scheduler.v2.Scheduler.getDueCards = getDueCards
+
+
+def getDueConnectionNotes(self, dueAnswers, node):
+    dueConnectionNotes = []
+    connections = []
+    connectionNids = self.smrGraph.nidsOfQuestions(
+        self.smrGraph.connections[node])
+    for nId, dueCards in zip(connectionNids, self.getDueCards(
+            nIds=connectionNids, dueAnswers=dueAnswers)):
+        connections.append(dict(nid=nId, dueCards=dueCards))
+        if len(connections[-1]['dueCards']) > 0:
+            dueConnectionNotes.append(
+                dict(dueCards=connections[-1]['dueCards'], nId=nId))
+    return connections, dueConnectionNotes
+
+
+scheduler.v2.Scheduler.getDueConnectionNotes = getDueConnectionNotes
+
+
+def getUrgentNote(self, nextNotes, nidList):
+    nextNids = set(map(lambda n: n['nId'], nextNotes))
+    # study notes in lrnQueue first, candidates are sorted by id so that the
+    # random choice does not depend on the order of the sets
+    noteCandidates = sorted(nextNids & nidList['lrn'])
+    if len(noteCandidates) == 0:
+        noteCandidates = sorted(nextNids & nidList['rev'])
+    if len(noteCandidates) == 0:
+        noteCandidates = sorted(nextNids & nidList['new'])
+    nextNote = random.choice(noteCandidates)
+    return nextNote
+
+
+scheduler.v2.Scheduler.getUrgentNote = getUrgentNote
+
+
+def getCardData(self, dueAnswers, cards, node):
+    nextNotes = []
+    # look up the due answers of all children at once
+    children = []
+    for crd in cards:
+        crd['children'] = []
+        for qId in self.smrGraph.children[node][crd['ord']]:
+            children.append((crd, qId, self.smrGraph.nidsOfQuestions([qId])[0]))
+    dueCards = self.getDueCards(nIds=[nId for _, _, nId in children],
+                                dueAnswers=dueAnswers)
+    for (crd, qId, nId), childDueCards in zip(children, dueCards):
+        if len(childDueCards) > 0:
+            nextNotes.append(dict(dueCards=childDueCards, nId=nId))
+        crd['children'].append(dict(qId=qId, nId=nId, dueCards=childDueCards))
+    return nextNotes
+
+
+scheduler.v2.Scheduler.getCardData = getCardData
+
+
+def getNextAnswer(self, nid, aId):
+    """returns the id of the note's first due card with an ord of at least
+    aId"""
+    dueAw2Note = self.smrGraph.dueAnswersToNotes([nid], self.smrDueCids)[nid]
+    awOrds = list(map(lambda c: c['ord'], dueAw2Note))
+    nextOrd = min(filter(lambda o: o >= aId, awOrds))
+    answerId = dueAw2Note[awOrds.index(nextOrd)]['cId']
+
+    return answerId
+
+
+scheduler.v2.Scheduler.getNextAnswer = getNextAnswer
+
+
+def getAnswerFurtherDown(self, notes, dueAnswers, nidList):
+    """searches the questions following the notes level by level and returns
+    the id of the first due answer of the most urgent note on the first level
+    with due answers, every note's children are only looked at once per
+    selection"""
+    level = notes
+    while len(level) > 0:
+        urgntNxtLvlNotes = []
+        allNxtLvlNids = []
+        for nxtNote in level:
+            if nxtNote['nId'] in self.smrExpandedNids:
+                continue
+            self.smrExpandedNids.add(nxtNote['nId'])
+            # no need to look further down if no question below is due
+            if not self.getDueCounts().mayHaveDueDescendants(
+                    self.smrGraph.node(nxtNote['nId'])):
+                continue
+            nxtNote['cards'] = list(map(lambda o: dict(ord=o),
+                                        self.smrGraph.cardOrds(nxtNote['nId'])))
+            urgntNxtLvlNotes.extend(
+                self.getCardData(dueAnswers=dueAnswers, cards=nxtNote['cards'],
+                                 node=self.smrGraph.node(nxtNote['nId'])))
+            for card in nxtNote['cards']:
+                for child in card['children']:
+                    allNxtLvlNids.append(dict(nId=child['nId']))
+        if len(urgntNxtLvlNotes) > 0:
+            nextNote = self.getUrgentNote(urgntNxtLvlNotes, nidList)
+            return self.getNextAnswer(nextNote, 0)
+        level = allNxtLvlNids
+    return None
+
+
+scheduler.v2.Scheduler.getAnswerFurtherDown = getAnswerFurtherDown
+
+
+def getDueCounts(self):
+    """returns the numbers of due cards of the notes in the review graph's
+    descendant index, kept up to date by the due queues"""
+    return self.smrDueQueues.getDueCounts(self.smrGraph)
+
+
+scheduler.v2.Scheduler.getDueCounts = getDueCounts
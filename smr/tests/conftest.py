@@ -0,0 +1,76 @@
+import os
+from typing import List
+
+import pytest
+from anki.collection import Collection
+
+from smr import dirtynotes, mapcache
+from smr.dto.deckselectiondialoguserinputsdto import DeckSelectionDialogUserInputsDTO
+from smr.duequeues import invalidateDueQueues
+from smr.prefetch import discardPrefetch
+from smr.reviewgraph import invalidateReviewGraphs
+from smr.template import add_x_model
+from smr.tests.constants import PATH_EXAMPLE_MAP_DEFAULT, TEMPORARY_EMPTY_COLLECTION_FUNCTION_PATH, TEST_DECK_NAME
+from smr.utils import invalidateSMRDecks
+from smr.xminder import XmindImporter
+
+
+@pytest.fixture(autouse=True)
+def temporary_map_cache(tmp_path, monkeypatch):
+    """
+    Makes the default MapCache write to a temporary directory instead of the add-on's user files
+    """
+    monkeypatch.setattr(mapcache, 'MAP_CACHE_PATH', str(tmp_path / 'map_cache'))
+
+
+@pytest.fixture(autouse=True)
+def temporary_dirty_notes(tmp_path, monkeypatch):
+    """
+    Makes the dirty notes start empty and be stored in a temporary directory instead of the add-on's user files
+    """
+    monkeypatch.setattr(dirtynotes, 'DIRTY_NOTES_PATH', str(tmp_path / 'dirty_notes'))
+    monkeypatch.setattr(dirtynotes, '_dirtyNotes', dict())
+
+
+@pytest.fixture
+def imported_maps() -> List[str]:
+    """
+    Paths of the maps that smr_collection imports, test modules override this fixture to import other maps
+    """
+    return [PATH_EXAMPLE_MAP_DEFAULT]
+
+
+def invalidate_caches():
+    discardPrefetch()
+    invalidateDueQueues()
+    invalidateReviewGraphs()
+    invalidateSMRDecks()
+
+
+@pytest.fixture(scope="function")
+def smr_collection(mocker, imported_maps) -> Collection:
+    """
+    Temporary collection with the SMR model and the maps of imported_maps in the test deck, which is selected for
+    studying without a limit of new cards. The review graphs, due queues, prefetched cards and SMR decks that are
+    cached between cards are dropped before and after each test.
+    """
+    try:
+        os.unlink(TEMPORARY_EMPTY_COLLECTION_FUNCTION_PATH)
+    except FileNotFoundError:
+        pass
+    collection = Collection(TEMPORARY_EMPTY_COLLECTION_FUNCTION_PATH)
+    add_x_model(collection)
+    deck_id = collection.decks.id(name=TEST_DECK_NAME)
+    for map_path in imported_maps:
+        importer = XmindImporter(col=collection, file=map_path)
+        importer.mw = mocker.MagicMock()
+        importer.importSheets(DeckSelectionDialogUserInputsDTO(deck_id=deck_id, deck_name=TEST_DECK_NAME))
+    config = collection.decks.config_dict_for_deck_id(deck_id)
+    config['new']['perDay'] = 9999
+    collection.decks.update_config(config)
+    collection.decks.select(deck_id)
+    collection.sched.reset()
+    invalidate_caches()
+    yield collection
+    invalidate_caches()
+    collection.close()
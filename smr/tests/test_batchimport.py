@@ -0,0 +1,53 @@
+import io
+import os
+
+from anki.collection import Collection
+
+from smr.batchimport import findMaps, getDeckName, importMaps
+from smr.tests.constants import DIRECTORY_MAPS_DEFAULT, PATH_EXAMPLE_MAP_DEFAULT, TEST_DECK_NAME
+
+
+def test_get_deck_name_uses_most_specific_entry():
+    # Given
+    root = os.path.join('maps')
+    mapping = {'': 'Default', 'biology': 'Biology', 'biology/cells': 'Biology::Cells'}
+
+    # When
+    deckNames = [getDeckName(mapPath=os.path.join(root, *p), root=root, mapping=mapping, defaultDeck=None) for p in
+                 [('chemistry.xmind',), ('biology', 'plants.xmind'), ('biology', 'cells', 'membrane.xmind')]]
+
+    # Then
+    assert deckNames == ['Default', 'Biology', 'Biology::Cells']
+    assert getDeckName(mapPath=os.path.join(root, 'a.xmind'), root=root, mapping={}, defaultDeck=None) is None
+
+
+def test_import_maps_imports_and_syncs_example_map(tmp_path):
+    # Given
+    col = Collection(str(tmp_path / 'collection.anki2'))
+    maps = [(m, TEST_DECK_NAME) for m in findMaps(DIRECTORY_MAPS_DEFAULT)]
+
+    # When
+    imported = importMaps(col=col, maps=maps, out=io.StringIO())
+    synchronized = importMaps(col=col, maps=maps, out=io.StringIO())
+
+    # Then
+    assert maps == [(os.path.abspath(PATH_EXAMPLE_MAP_DEFAULT), TEST_DECK_NAME)]
+    assert imported == dict(added=21, updated=0, removed=0, failed=0)
+    assert synchronized['added'] == 0 and synchronized['removed'] == 0
+    assert col.db.scalar('select count() from notes') == 21
+    col.close()
+
+
+def test_import_maps_compiles_sheets_of_single_map_in_worker_processes(tmp_path):
+    # Given
+    col = Collection(str(tmp_path / 'collection.anki2'))
+    maps = [(os.path.abspath(PATH_EXAMPLE_MAP_DEFAULT), TEST_DECK_NAME)]
+
+    # When
+    imported = importMaps(col=col, maps=maps, jobs=2, allSheets=True, out=io.StringIO())
+
+    # Then
+    assert imported['failed'] == 0
+    assert sorted(col.tags.all()) == [TEST_DECK_NAME + '::biological_psychology',
+                                      TEST_DECK_NAME + '::clinical_psychology']
+    col.close()
@@ -0,0 +1,77 @@
+import pytest
+
+from smr import dirtynotes
+from smr.dirtynotes import clearDirtyNotes, getDirtyNotes, markAllNotesDirty, markNotesDirty, saveDirtyNotes
+
+
+@pytest.fixture
+def imported_maps():
+    """
+    No maps, the dirty notes do not depend on the notes in the collection
+    """
+    return []
+
+
+def test_all_notes_are_dirty_in_new_collections(smr_collection):
+    # When
+    dirty_notes = getDirtyNotes(smr_collection)
+
+    # Then
+    assert dirty_notes is None
+
+
+def test_mark_notes_dirty(smr_collection):
+    # Given
+    col = smr_collection
+    clearDirtyNotes(col)
+
+    # When
+    markNotesDirty(col, [1, 2])
+    markNotesDirty(col, [2, 3])
+
+    # Then
+    assert getDirtyNotes(col) == {1, 2, 3}
+
+
+def test_mark_all_notes_dirty(smr_collection):
+    # Given
+    col = smr_collection
+    clearDirtyNotes(col)
+    markNotesDirty(col, [1])
+
+    # When
+    markAllNotesDirty(col)
+
+    # Then
+    assert getDirtyNotes(col) is None
+    clearDirtyNotes(col)
+    assert getDirtyNotes(col) == set()
+
+
+def test_dirty_notes_are_kept_in_memory_and_saved_on_close(smr_collection, mocker):
+    # Given
+    col = smr_collection
+    clearDirtyNotes(col)
+    db_execute = mocker.spy(col.db, 'execute')
+
+    # When
+    markNotesDirty(col, [1, 2])
+    saveDirtyNotes(col)
+    dirtynotes._dirtyNotes.clear()
+
+    # Then
+    db_execute.assert_not_called()
+    assert getDirtyNotes(col) == {1, 2}
+
+
+def test_all_notes_are_dirty_if_the_collection_was_not_closed_properly(smr_collection):
+    # Given
+    col = smr_collection
+    clearDirtyNotes(col)
+    markNotesDirty(col, [1])
+
+    # When
+    dirtynotes._dirtyNotes.clear()
+
+    # Then
+    assert getDirtyNotes(col) is None
@@ -0,0 +1,72 @@
+import time
+
+from smr.duequeues import getDueQueues, onCardAnswered
+from smr.reviewgraph import getReviewGraph
+from smr.tests.constants import TEST_DECK_NAME
+
+
+def test_due_queues(smr_collection):
+    # Given
+    col = smr_collection
+    did = col.decks.id(name=TEST_DECK_NAME)
+
+    # When
+    due_queues = getDueQueues(col.sched)
+
+    # Then
+    assert list(due_queues.new) == col.db.list("select id from cards where did = ? and queue = 0 order by due, ord",
+                                               did)
+    assert due_queues.lrnQueue(time.time()) == []
+    assert set(due_queues.newNids) == set(col.db.list("select nid from cards where did = ?", did))
+    assert getDueQueues(col.sched) is due_queues
+
+
+def test_due_queues_are_updated_with_answered_cards(smr_collection):
+    # Given
+    col = smr_collection
+    due_queues = getDueQueues(col.sched)
+    card = col.get_card(next(iter(due_queues.new)))
+    card.start_timer()
+
+    # When
+    col.sched.answerCard(card, 1)
+    onCardAnswered(card)
+
+    # Then
+    assert card.id not in due_queues.new
+    assert due_queues.lrn == {card.id: card.due}
+    assert due_queues.lrnNids(card.due + 1) == {card.nid}
+    assert getDueQueues(col.sched) is due_queues
+
+
+def test_due_counts_are_updated_with_answered_cards(smr_collection):
+    # Given
+    col = smr_collection
+    due_queues = getDueQueues(col.sched)
+    graph = getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME))
+    due_counts = due_queues.getDueCounts(graph)
+    card = col.get_card(next(iter(due_queues.new)))
+    card.start_timer()
+
+    # When
+    col.sched.answerCard(card, 4)
+    onCardAnswered(card)
+
+    # Then
+    assert card.id not in due_queues.nidByCid
+    assert due_queues.getDueCounts(graph) is due_counts
+    assert due_counts.tree == graph.descendantIndex().dueCounts(graph=graph, nids=due_queues.nidByCid.values()).tree
+
+
+def test_due_queues_are_queried_again_for_other_decks(smr_collection):
+    # Given
+    col = smr_collection
+    due_queues = getDueQueues(col.sched)
+
+    # When
+    col.decks.select(col.decks.id(name='other deck'))
+    col.sched.reset()
+
+    # Then
+    assert getDueQueues(col.sched) is not due_queues
+    assert not getDueQueues(col.sched).new
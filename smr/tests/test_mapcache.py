@@ -0,0 +1,93 @@
+import os
+import shutil
+import zipfile
+
+from smr import mapcache
+from smr.mapcache import MapCache
+from smr.tests.constants import PATH_EXAMPLE_MAP_DEFAULT
+from smr.xmindloader import loadContent
+
+
+def content_tuples(content):
+    return [(s.id, s.title, s.rootTopic.id, [
+        (n.id, n.title, n.image, n.hyperlink, n.crosslink, n.depth, n.parent.id if n.parent else None,
+         tuple(c.id for c in n.children)) for n in s.topics]) for s in content.sheets]
+
+
+def copy_map(tmp_path):
+    path = str(tmp_path / 'example map.xmind')
+    shutil.copy(PATH_EXAMPLE_MAP_DEFAULT, path)
+    return path
+
+
+def test_cached_content_equals_parsed_content(tmp_path):
+    # Given
+    path = copy_map(tmp_path)
+    cache = MapCache(directory=str(tmp_path / 'cache'))
+    parsed = cache.load(path, zipfile.ZipFile(path))
+
+    # When
+    cached = cache.get(path)
+
+    # Then
+    assert content_tuples(cached) == content_tuples(parsed)
+    assert content_tuples(cached) == content_tuples(loadContent(zipfile.ZipFile(path)))
+    assert all(cached.getTopic(n.id) is n for n in cached.topics)
+
+
+def test_touched_map_is_validated_by_hash(tmp_path):
+    # Given
+    path = copy_map(tmp_path)
+    cache = MapCache(directory=str(tmp_path / 'cache'))
+    cache.load(path, zipfile.ZipFile(path))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    # Then
+    assert cache.get(path) is not None
+
+    # When
+    with zipfile.ZipFile(path, 'a') as x_zip:
+        x_zip.writestr('new.txt', 'changed')
+
+    # Then
+    assert cache.get(path) is None
+
+
+def test_entries_of_other_versions_are_dropped(tmp_path, mocker):
+    # Given
+    path = copy_map(tmp_path)
+    cache = MapCache(directory=str(tmp_path / 'cache'))
+    cache.load(path, zipfile.ZipFile(path))
+
+    # When
+    mocker.patch.object(mapcache, 'X_MAP_CACHE_VERSION', mapcache.X_MAP_CACHE_VERSION + 1)
+
+    # Then
+    assert cache.get(path) is None
+    assert cache.cacheFiles() == []
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    # Given
+    paths = []
+    for name in ['a', 'b', 'c']:
+        path = str(tmp_path / (name + '.xmind'))
+        shutil.copy(PATH_EXAMPLE_MAP_DEFAULT, path)
+        paths.append(path)
+    cache = MapCache(directory=str(tmp_path / 'cache'))
+    cache.load(paths[0], zipfile.ZipFile(paths[0]))
+    entry_size = os.path.getsize(cache.cacheFile(paths[0]))
+    cache.maxBytes = 2 * entry_size
+    cache.load(paths[1], zipfile.ZipFile(paths[1]))
+    os.utime(cache.cacheFile(paths[0]), ns=(0, 0))
+    os.utime(cache.cacheFile(paths[1]), ns=(1, 1))
+
+    # When
+    cache.get(paths[0])
+    cache.load(paths[2], zipfile.ZipFile(paths[2]))
+
+    # Then
+    assert os.path.exists(cache.cacheFile(paths[0]))
+    assert not os.path.exists(cache.cacheFile(paths[1]))
+    assert os.path.exists(cache.cacheFile(paths[2]))
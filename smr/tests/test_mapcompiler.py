@@ -0,0 +1,101 @@
+import io
+import zipfile
+
+from smr.consts import X_FLDS
+from smr.mapcompiler import MapCompiler, compileSheets, sheetTag
+from smr.tests.constants import PATH_EXAMPLE_MAP_DEFAULT
+
+
+def map_with_answer_link(link):
+    """
+    Returns the bytes of a map with a question whose first answer contains a hyperlink to the topic with id link
+    """
+    content = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?><xmap-content '
+        'xmlns="urn:xmind:xmap:xmlns:content:2.0" xmlns:xhtml="http://www.w3.org/1999/xhtml" '
+        'xmlns:xlink="http://www.w3.org/1999/xlink" version="2.0"><sheet id="s1"><topic id="r"><title>root</title>'
+        '<children><topics type="attached"><topic id="q1"><title>question</title><children><topics type="attached">'
+        '<topic id="a1" xlink:href="xmind:#%s"><title>answer 1</title></topic>'
+        '<topic id="a2"><title>answer 2</title></topic></topics></children></topic></topics></children></topic>'
+        '<title>Sheet 1</title></sheet></xmap-content>') % link
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, 'w') as xmind_file:
+        xmind_file.writestr('content.xml', content)
+        xmind_file.writestr('META-INF/manifest.xml', '<manifest></manifest>')
+    return data.getvalue()
+
+
+def test_compile_example_map():
+    # Given
+    N_NOTES_EXAMPLE_MAP = 21
+    compiler = MapCompiler(file=PATH_EXAMPLE_MAP_DEFAULT, useMapCache=False)
+
+    # When
+    compiledSheet = compiler.compileSheet(sheet=compiler.content.sheets[0], tag='hi')
+
+    # Then
+    assert compiledSheet.running
+    assert compiledSheet.tag == 'hi'
+    assert len(compiledSheet.notes) == N_NOTES_EXAMPLE_MAP
+    assert all(len(note.fields) == len(X_FLDS) for note in compiledSheet.notes)
+    assert len(set(note.questionId for note in compiledSheet.notes)) == N_NOTES_EXAMPLE_MAP
+    assert len(compiledSheet.media) == len(set((m['image'], m['media']) for m in compiledSheet.media))
+    assert not compiler.questionListCache
+
+
+def test_compile_map_from_bytes():
+    # Given
+    with open(PATH_EXAMPLE_MAP_DEFAULT, 'rb') as file:
+        data = file.read()
+    fromFile = MapCompiler(file=PATH_EXAMPLE_MAP_DEFAULT, useMapCache=False)
+    fromBytes = MapCompiler(file=PATH_EXAMPLE_MAP_DEFAULT, data=data)
+
+    # When
+    notesFromFile = fromFile.compileSheet(sheet=fromFile.content.sheets[0]).notes
+    notesFromBytes = fromBytes.compileSheet(sheet=fromBytes.content.sheets[0]).notes
+
+    # Then
+    assert [n.fields[:-1] for n in notesFromBytes] == [n.fields[:-1] for n in notesFromFile]
+
+
+def test_compile_sheets_in_worker_processes():
+    # Given
+    compiler = MapCompiler(file=PATH_EXAMPLE_MAP_DEFAULT, useMapCache=False)
+    sheets = compiler.content.sheets
+    tags = [sheetTag(deckName='deck', sheet=sheet) for sheet in sheets]
+
+    # When
+    inWorkers = compileSheets(compiler=compiler, sheets=sheets, tags=tags, jobs=2)
+    inProcess = compileSheets(compiler=compiler, sheets=sheets, tags=tags, jobs=1)
+
+    # Then
+    assert [c.tag for c in inWorkers] == ['deck::biological_psychology', 'deck::clinical_psychology']
+    assert [c.sheetId for c in inWorkers] == [s.id for s in sheets]
+    assert [[n.fields[:-1] for n in c.notes] for c in inWorkers] == \
+           [[n.fields[:-1] for n in c.notes] for c in inProcess]
+
+
+def test_compile_sheet_with_hyperlink_to_deleted_node():
+    # Given
+    compiler = MapCompiler(file='dangling.xmind', data=map_with_answer_link('gone'), useMapCache=False)
+
+    # When
+    compiledSheet = compiler.compileSheet(sheet=compiler.content.sheets[0])
+
+    # Then
+    assert not compiledSheet.running
+    assert compiledSheet.notes == []
+    assert len(compiledSheet.log) == 1
+    assert 'contains a hyperlink to a deleted node' in compiledSheet.log[0]
+
+
+def test_compile_sheet_with_hyperlink_to_existing_node():
+    # Given
+    compiler = MapCompiler(file='linked.xmind', data=map_with_answer_link('a2'), useMapCache=False)
+
+    # When
+    compiledSheet = compiler.compileSheet(sheet=compiler.content.sheets[0])
+
+    # Then
+    assert compiledSheet.running
+    assert len(compiledSheet.notes) == 1
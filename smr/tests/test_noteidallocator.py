@@ -0,0 +1,27 @@
+from anki.collection import Collection
+
+from smr.noteidallocator import NoteIdAllocator
+
+
+def test_allocate_reserved_ids(tmp_path, mocker):
+    # Given
+    col = Collection(str(tmp_path / 'collection.anki2'))
+    note = col.new_note(col.models.by_name('Basic'))
+    note['Front'] = 'front'
+    col.add_note(note, col.decks.id('Default'))
+    # an id far in the future so that the block has to start after it
+    col.db.execute('update notes set id = ? where id = ?', note.id + 10 ** 9, note.id)
+    allocator = NoteIdAllocator(col)
+    scalar = mocker.spy(col.db, 'scalar')
+
+    # When
+    allocator.reserve(3)
+    allocated = [allocator.allocate() for _ in range(3)]
+
+    # Then
+    assert scalar.call_count == 1
+    assert [noteId for noteId, _ in allocated] == list(range(note.id + 10 ** 9 + 1, note.id + 10 ** 9 + 4))
+    assert len(set(guid for _, guid in allocated)) == 3
+    # a new block is reserved once the block is used up, it starts after the highest id in the notes table again
+    assert allocator.allocate()[0] == note.id + 10 ** 9 + 1
+    col.close()
@@ -0,0 +1,81 @@
+from smr.noteindex import ensureIndex, rebuildIndex, unindexNotes, updateIndex
+from smr.tests.constants import PATH_EXAMPLE_MAP_DEFAULT, TEST_DECK_NAME
+from smr.utils import getNotesFromQIds, getNotesFromSheet, getSheetTagAndDeck, questionIdFromFields
+from smr.xminder import XmindImporter
+
+
+def test_import_indexes_notes(smr_collection):
+    # Given
+    col = smr_collection
+    notes = col.db.all("select id, flds from notes order by id")
+    sheet_id = XmindImporter(col=col, file=PATH_EXAMPLE_MAP_DEFAULT).content.sheets[0].id
+
+    # When
+    notes_from_sheet = getNotesFromSheet(sheetId=sheet_id, col=col)
+    notes_from_q_ids = getNotesFromQIds(qIds=[questionIdFromFields(flds) for _, flds in reversed(notes)], col=col)
+    tag, did = getSheetTagAndDeck(sheetId=sheet_id, col=col)
+
+    # Then
+    assert notes_from_sheet == notes
+    assert notes_from_q_ids == [nid for nid, _ in reversed(notes)]
+    assert tag.strip() == 'testdeck::biological_psychology'
+    assert did == col.decks.id(name=TEST_DECK_NAME)
+
+
+def test_rebuild_index(smr_collection):
+    # Given
+    col = smr_collection
+    nids = col.db.list("select id from notes")
+    unindexNotes(col, nids)
+
+    # When
+    n_indexed = rebuildIndex(col)
+
+    # Then
+    assert n_indexed == len(nids)
+    assert col.db.list("select nid from smr_notes order by nid") == sorted(nids)
+    assert col.db.scalar("select count() from smr_answers") == col.db.scalar("select count() from cards")
+
+
+def test_deleted_notes_are_not_found(smr_collection):
+    # Given
+    col = smr_collection
+    nid, flds = col.db.first("select id, flds from notes")
+
+    # When
+    col.remove_notes([nid])
+
+    # Then
+    assert getNotesFromQIds(qIds=[questionIdFromFields(flds)], col=col) == []
+
+
+def test_update_index_reindexes_changed_and_removed_notes(smr_collection):
+    # Given
+    col = smr_collection
+    (changed_nid, flds), (removed_nid, _) = col.db.all("select id, flds from notes order by id limit 2")
+    changed_flds = flds.replace(questionIdFromFields(flds), 'changed question id')
+    # notes changed or removed by a sync
+    col.db.execute("update notes set flds = ?, mod = mod + 1 where id = ?", changed_flds, changed_nid)
+    col.db.execute("delete from notes where id = ?", removed_nid)
+
+    # When
+    n_updated = updateIndex(col)
+
+    # Then
+    assert n_updated == 2
+    assert getNotesFromQIds(qIds=['changed question id'], col=col) == [changed_nid]
+    assert col.db.scalar("select count() from smr_notes where nid = ?", removed_nid) == 0
+    assert updateIndex(col) == 0
+
+
+def test_ensure_index_rebuilds_index_without_modification_times(smr_collection):
+    # Given
+    col = smr_collection
+    col.db.execute("alter table smr_notes drop column mod")
+
+    # When
+    ensureIndex(col)
+
+    # Then
+    assert updateIndex(col) == 0
+    assert col.db.scalar("select count() from smr_notes") == col.db.scalar("select count() from notes")
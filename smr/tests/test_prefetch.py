@@ -0,0 +1,122 @@
+import random
+import threading
+from unittest import mock
+
+from anki.consts import QUEUE_TYPE_LRN
+
+# noinspection PyUnresolvedReferences
+from smr import smrscheduler
+from smr.duequeues import getDueQueues, onCardAnswered
+from smr import prefetch as smr_prefetch
+from smr.prefetch import startPrefetch, takePrefetch
+from smr.reviewgraph import getReviewGraph
+
+
+def answer(col, card, ease):
+    card.start_timer()
+    col.sched.answerCard(card, ease)
+    onCardAnswered(card)
+
+
+def test_prefetched_card_is_the_selected_card(smr_collection):
+    # Given
+    col = smr_collection
+    card = col.sched.getNextSMRCard([])
+    learn_history = [[card.nid, [card.id]]]
+    random_state = random.getstate()
+    startPrefetch(col.sched, learn_history, card)
+    answer(col, card, 3)
+
+    # When
+    prefetch = takePrefetch(col.sched, card.id)
+
+    # Then
+    random.setstate(random_state)
+    assert prefetch.card.id == col.sched.getNextSMRCard(learn_history).id
+    assert prefetch.learnHistory == learn_history
+    assert col.sched.newCount == len(col.sched._newQueue)
+
+
+def test_prefetched_card_is_discarded_if_due_cards_change(smr_collection):
+    # Given
+    col = smr_collection
+    card = col.sched.getNextSMRCard([])
+    startPrefetch(col.sched, [[card.nid, [card.id]]], card)
+    answer(col, card, 3)
+    other_card = col.get_card(list(col.sched._newQueue)[-1])
+    col.sched.buryCards([other_card.id])
+    onCardAnswered(other_card)
+
+    # When
+    prefetch = takePrefetch(col.sched, card.id)
+
+    # Then
+    assert prefetch is None
+
+
+def test_prefetched_card_is_discarded_if_learning_cards_become_due(smr_collection):
+    # Given
+    col = smr_collection
+    card = col.sched.getNextSMRCard([])
+    startPrefetch(col.sched, [[card.nid, [card.id]]], card)
+    answer(col, card, 3)
+    smr_prefetch._prefetch.future.result()
+    other_card = col.get_card(col.db.scalar("select id from cards where nid != ?", card.nid))
+    getDueQueues(col.sched).addCard(cid=other_card.id, nid=other_card.nid, queue=QUEUE_TYPE_LRN,
+                                    due=smr_prefetch._prefetch.selectedAt)
+
+    # When
+    prefetch = takePrefetch(col.sched, card.id)
+
+    # Then
+    assert prefetch is None
+
+
+def test_prefetched_card_is_discarded_for_other_cards(smr_collection):
+    # Given
+    col = smr_collection
+    card = col.sched.getNextSMRCard([])
+    startPrefetch(col.sched, [[card.nid, [card.id]]], card)
+
+    # When
+    prefetch = takePrefetch(col.sched, card.id + 1)
+
+    # Then
+    assert prefetch is None
+    assert takePrefetch(col.sched, card.id) is None
+
+
+def test_prefetch_does_not_query_the_collection_on_the_worker(smr_collection, mocker):
+    # Given
+    col = smr_collection
+    card = col.sched.getNextSMRCard([])
+    worker_blocked = threading.Event()
+    smr_prefetch._executor.submit(worker_blocked.wait)
+    startPrefetch(col.sched, [[card.nid, [card.id]]], card)
+    get_card = mocker.patch.object(col, 'get_card', side_effect=AssertionError)
+
+    # When
+    with mock.patch.object(col, 'db', mocker.Mock(spec=[])):
+        worker_blocked.set()
+        smr_prefetch._prefetch.future.result()
+
+    # Then
+    assert smr_prefetch._prefetch.answerId
+    get_card.assert_not_called()
+
+
+def test_prefetch_only_adds_the_notes_of_the_due_cards_once(smr_collection, mocker):
+    # Given
+    col = smr_collection
+    card = col.sched.getNextSMRCard([])
+    startPrefetch(col.sched, [[card.nid, [card.id]]], card)
+    answer(col, card, 3)
+    next_card = takePrefetch(col.sched, card.id).card
+    add_reachable_notes = mocker.spy(getReviewGraph(col, col.decks.selected()), 'addReachableNotes')
+
+    # When
+    startPrefetch(col.sched, [[card.nid, [card.id]], [next_card.nid, [next_card.id]]], next_card)
+
+    # Then
+    add_reachable_notes.assert_called_once_with([next_card.nid])
+    assert next_card.id in getDueQueues(col.sched).nidByCid
@@ -0,0 +1,129 @@
+from smr.dto.deckselectiondialoguserinputsdto import DeckSelectionDialogUserInputsDTO
+from smr.reviewgraph import getReviewGraph, invalidateReviewGraphs
+from smr.tests.constants import PATH_EXAMPLE_MAP_DEFAULT, TEST_DECK_NAME
+from smr.utils import getNotesFromQIds, questionIdFromFields
+from smr.xminder import XmindImporter
+
+
+def test_review_graph(smr_collection):
+    # Given
+    col = smr_collection
+    notes = col.db.all("select id, flds from notes order by id")
+    q_ids = [questionIdFromFields(flds) for _, flds in notes]
+
+    # When
+    graph = getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME))
+
+    # Then
+    assert graph.nids == [nid for nid, _ in notes]
+    assert graph.nidsOfQuestions(q_ids) == getNotesFromQIds(qIds=q_ids, col=col)
+    for nid, _ in notes:
+        assert graph.cardOrds(nid) == col.db.list("select ord from cards where nid = ? order by id", nid)
+    assert getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME)) is graph
+
+
+def test_review_graph_adds_notes_of_other_decks(smr_collection, mocker):
+    # Given
+    col = smr_collection
+    importer = XmindImporter(col=col, file=PATH_EXAMPLE_MAP_DEFAULT)
+    importer.mw = mocker.MagicMock()
+    importer.importSheets(DeckSelectionDialogUserInputsDTO(
+        deck_id=col.decks.id(name='other deck'), deck_name='other deck', all_sheets=True))
+    other_nid = col.db.scalar("select max(nid) from cards where did = ?", col.decks.id(name='other deck'))
+    graph = getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME))
+    n_nodes = len(graph.nids)
+
+    # When
+    node = graph.node(other_nid)
+
+    # Then
+    assert other_nid not in graph.nids[:n_nodes]
+    assert graph.nids[node] == other_nid
+    assert graph.cardOrds(other_nid) == col.db.list("select ord from cards where nid = ? order by id", other_nid)
+
+
+def test_review_graph_is_shared_with_the_scheduler(smr_collection):
+    # Given
+    col = smr_collection
+    did = col.decks.id(name=TEST_DECK_NAME)
+
+    # When
+    graph = getReviewGraph(col, did)
+
+    # Then
+    assert getReviewGraph(col.sched.col, did) is graph
+    assert getReviewGraph(col, did) is graph
+
+
+def test_invalidate_review_graphs(smr_collection):
+    # Given
+    col = smr_collection
+    graph = getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME))
+
+    # When
+    invalidateReviewGraphs()
+
+    # Then
+    assert getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME)) is not graph
+
+
+def test_descendant_index(smr_collection):
+    # Given
+    col = smr_collection
+    graph = getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME))
+
+    # When
+    index = graph.descendantIndex()
+
+    # Then
+    assert sorted(index.order) == list(range(len(graph.nids)))
+    assert index.closed[index.order[0]]
+    for node in range(len(graph.nids)):
+        reachable = set()
+        stack = [node]
+        while stack:
+            for child in graph.childNodes(stack.pop()):
+                if child not in reachable:
+                    reachable.add(child)
+                    stack.append(child)
+        descendants = set(index.order[index.entry[node] + 1:index.exit[node] + 1])
+        assert descendants <= reachable | {node}
+        if index.closed[node]:
+            assert reachable - {node} == descendants
+
+
+def test_due_counts(smr_collection):
+    # Given
+    col = smr_collection
+    graph = getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME))
+    index = graph.descendantIndex()
+    leaf = next(n for n in index.order if not graph.childNodes(n))
+    root = index.order[0]
+
+    # When
+    due_counts = index.dueCounts(graph=graph, nids=[graph.nids[leaf]] * len(graph.cards[leaf]))
+
+    # Then
+    assert due_counts.mayHaveDueDescendants(root)
+    assert due_counts.mayHaveDueDescendants(leaf)
+    assert not due_counts.mayHaveDueDescendants(next(n for n in index.order if n != leaf and not graph.childNodes(n)))
+
+
+def test_due_counts_are_updated_card_by_card(smr_collection):
+    # Given
+    col = smr_collection
+    graph = getReviewGraph(col, col.decks.id(name=TEST_DECK_NAME))
+    index = graph.descendantIndex()
+    due_counts = index.dueCounts(graph=graph, nids=[graph.nids[node] for node in index.order])
+    due_nodes = set(index.order[len(index.order) // 2::3])
+
+    # When
+    for node in index.order:
+        if node not in due_nodes:
+            due_counts.add(graph.nids[node], -1)
+
+    # Then
+    for node in index.order:
+        subtree = index.order[index.entry[node]:index.exit[node] + 1]
+        assert due_counts.firstDueDescendant(node) == next((n for n in subtree if n in due_nodes), None)
+        assert due_counts.mayHaveDueDescendants(node) == (not index.closed[node] or bool(due_nodes & set(subtree)))
@@ -0,0 +1,67 @@
+import zipfile
+
+from smr.mapnode import CONCEPT, RELATIONSHIP, MapNode
+from smr.sheetanalyzer import analyzeContent, analyzeSheet
+from smr.tests.constants import PATH_EXAMPLE_MAP_DEFAULT
+from smr.xmindloader import XmindContent, XmindSheet, loadContent
+
+
+def is_question_recursive(node, level=0):
+    if not node.parent:
+        return level % 2 == 1
+    return is_question_recursive(node.parent, level + 1)
+
+
+def test_analyze_sheet():
+    # Given
+    content = loadContent(zipfile.ZipFile(PATH_EXAMPLE_MAP_DEFAULT, 'r'))
+    sheet = content.sheets[0]
+
+    # When
+    analyzeSheet(content, sheet)
+
+    # Then
+    assert sheet.analyzed
+    assert sheet.rootTopic.role == CONCEPT
+    assert all(child.role == RELATIONSHIP for child in sheet.rootTopic.children)
+    assert all(node.isQuestion == is_question_recursive(node) for node in sheet.topics)
+    assert all(node.isEmpty == (not (node.title or node.image or node.hyperlink)) for node in sheet.topics)
+    assert any(node.isBridge for node in sheet.topics)
+
+
+def test_analyze_sheet_resolves_crosslinks():
+    # Given
+    content = XmindContent()
+    sheet = XmindSheet(id='sheet')
+    root = MapNode(id='root', title='root')
+    question = MapNode(id='question', title='question', parent=root)
+    answer = MapNode(id='answer', hyperlink='xmind:#question', parent=question)
+    deleted_link = MapNode(id='deleted link', hyperlink='xmind:#deleted', parent=question)
+    for node in [root, question, answer, deleted_link]:
+        content.addTopic(node)
+        sheet.topics.append(node)
+    content.sheets.append(sheet)
+
+    # When
+    analyzeSheet(content, sheet)
+
+    # Then
+    assert answer.crosslinkTarget is question
+    assert answer.role == CONCEPT and not answer.isEmpty
+    assert deleted_link.crosslinkTarget is None
+    assert root.crosslinkTarget is None
+
+
+def test_analyze_content_analyzes_each_sheet_once():
+    # Given
+    content = loadContent(zipfile.ZipFile(PATH_EXAMPLE_MAP_DEFAULT, 'r'))
+    analyzeContent(content)
+    root = content.sheets[0].rootTopic
+    root.role = RELATIONSHIP
+
+    # When
+    analyzeContent(content)
+
+    # Then
+    assert all(sheet.analyzed for sheet in content.sheets)
+    assert root.role == RELATIONSHIP
@@ -0,0 +1,446 @@
+import json
+import random
+import re
+import time
+import zipfile
+from typing import cast
+from xml.sax.saxutils import escape
+
+import pytest
+from anki.cards import CardId
+from anki.utils import ids2str
+
+# noinspection PyUnresolvedReferences
+from smr import smrscheduler
+from smr.consts import X_FLDS_META_INDEX
+from smr.duequeues import getDueQueues, onCardAnswered
+from smr.tests.constants import TEST_DECK_NAME
+
+
+N_GENERATED_MAPS = 5
+N_REVIEWS = 150
+
+
+def write_generated_map(path, seed, n_questions=40, answer_links=True):
+    """
+    Writes a random map with questions of up to three answers and crosslinks between questions and, unless answer_links
+    is False, between answers. Crosslinks between answers may make the questions following an answer cyclic.
+    """
+    rnd = random.Random(seed)
+    topic_ids = iter(range(10 ** 6))
+    answers, questions = [], []
+
+    def topic(depth, is_question, budget):
+        topic_id = 't%d' % next(topic_ids)
+        (questions if is_question else answers).append(topic_id)
+        children = []
+        if depth < 6 and budget[0] > 0:
+            for _ in range(rnd.randint(1, 3) if is_question or depth == 0 else rnd.randint(0, 3)):
+                budget[0] -= 1
+                children.append(topic(depth + 1, not is_question, budget))
+        if is_question and not children:
+            children.append('<topic id="t%d"><title>leaf</title></topic>' % next(topic_ids))
+        children = '<children><topics type="attached">%s</topics></children>' % ''.join(children) if children else ''
+        return '<topic id="%s" @@LINK%s@@><title>%s</title>%s</topic>' % (
+            topic_id, topic_id, escape(('Q ' if is_question else 'A ') + topic_id), children)
+
+    def link(match):
+        topic_id = match.group(1)
+        r = rnd.random()
+        if r < 0.12 and topic_id in questions:
+            return 'xlink:href="xmind:#%s"' % rnd.choice(questions)
+        if r < 0.22 and topic_id in answers and answer_links:
+            return 'xlink:href="xmind:#%s"' % rnd.choice(answers)
+        return ''
+
+    root = re.sub(r'@@LINK(t\d+)@@', link, topic(0, False, [n_questions]))
+    with zipfile.ZipFile(path, 'w') as xmind_file:
+        xmind_file.writestr('content.xml', (
+                '<?xml version="1.0" encoding="UTF-8" standalone="no"?><xmap-content '
+                'xmlns="urn:xmind:xmap:xmlns:content:2.0" xmlns:xhtml="http://www.w3.org/1999/xhtml" '
+                'xmlns:xlink="http://www.w3.org/1999/xlink" version="2.0"><sheet id="s%d">%s<title>Sheet 1</title>'
+                '</sheet></xmap-content>') % (seed, root))
+        xmind_file.writestr('META-INF/manifest.xml', '<manifest></manifest>')
+
+
+def getNotesFromQIds(qIds, col):
+    return sum(map(lambda qId: col.db.list(
+        "select id from notes where flds like '%\"questionId\": \"" +
+        qId + "\"%'"), qIds), [])
+
+
+def getDueAnswersToNote(nId, dueAnswers, col):
+    cardTpls = list(col.db.execute(
+        """select id, ord from cards where nid = ? and id in """ + ids2str(
+            dueAnswers), nId))
+    cards = []
+    for cardTpl in cardTpls:
+        cards.append(dict(cId=cardTpl[0], ord=cardTpl[1]))
+    return cards
+
+
+class RecursiveSelection:
+    """
+    Copy of the recursive selection of SMR cards from before the review graph and the due queues were added, looks up
+    notes and due answers with queries and examines the notes around each entry of the learn history anew. The methods
+    are the original functions patched into the scheduler, only the meta field is read with its current index.
+    """
+
+    def __init__(self, col):
+        self.col = col
+        self.sched = col.sched
+        self.today = self.sched.today
+        self._lrnDids = self.sched._lrnDids
+        self._deck_limit = self.sched._deck_limit
+
+    def getNextSMRCard(self, learnHistory):
+        self._lrnQueue = self.col.db.all("""
+            select due, id from cards where did in %s and queue = 1 and due < ?""" %
+                                         self._deck_limit(), time.time())
+        self._lrnQueue = [cast(tuple[int, CardId], tuple(e)) for e in self._lrnQueue]
+        self.lrnCount = len(self._lrnQueue)
+
+        self._revQueue = self.col.db.list("""
+            select id from cards where did = ? and queue = 2 and due <= ?""",
+                                          self._lrnDids[0], self.today)
+        self.revCount = len(self._revQueue)
+
+        self._newQueue = self.col.db.list("""
+            select id from cards where did = ? and queue = 0 order by due, ord""",
+                                          self._lrnDids[0])
+        self.newCount = len(self._newQueue)
+
+        nidList = dict()
+        nidList['lrn'] = list(set(self.col.db.list(
+            """select nid from cards where id in """ + ids2str([t[1] for t in self._lrnQueue]))))
+        nidList['rev'] = list(set(self.col.db.list(
+            """select nid from cards where id in """ + ids2str(self._revQueue))))
+        nidList['new'] = list(set(self.col.db.list(
+            """select nid from cards where id in """ + ids2str(self._newQueue))))
+        nidList['all'] = nidList['lrn'] + nidList['rev'] + nidList['new']
+
+        # if the user starts studying or a branch was completely studied
+        if len(learnHistory) == 0:
+            # get shortest sortID among available notes
+            minIDLength = self.col.db.list("""
+                select min(length(sfld)) from notes where id in """ + ids2str(
+                nidList['all']))
+            startingNotes = self.col.db.list(
+                "select id from notes where LENGTH(sfld) = ? and id in " + ids2str(
+                    nidList['lrn']), minIDLength[0])
+            if len(startingNotes) == 0:
+                startingNotes = self.col.db.list(
+                    "select id from notes where LENGTH(sfld) = ? and id in " +
+                    ids2str(nidList['rev']), minIDLength[0])
+            if len(startingNotes) == 0:
+                startingNotes = self.col.db.list(
+                    "select id from notes where LENGTH(sfld) = ? and id in " +
+                    ids2str(nidList['new']), minIDLength[0])
+            if len(startingNotes) == 0:
+                return None
+
+            startingNote = random.choice(startingNotes)
+
+            return self.getNextAnswer(startingNote, 0)
+
+        # get last from last note that was studied
+        lastNoteLst = learnHistory[-1]
+        dueAnswers = [t[1] for t in self._lrnQueue] + self._revQueue + self._newQueue
+        dueAw2Note = getDueAnswersToNote(nId=lastNoteLst[0], dueAnswers=dueAnswers,
+                                         col=self.col)
+        awOrds = list(map(lambda t: t['ord'], dueAw2Note))
+
+        lstCrd = self.col.get_card(lastNoteLst[1][-1])
+
+        # if that note has further due answers that follow it, return the next
+        # Answer
+        if len(dueAw2Note) > 0 and max(awOrds) > lstCrd.ord:
+            return self.getNextAnswer(lastNoteLst[0], lstCrd.ord + 1)
+
+        # get Children of the answers that were answered for the last note
+        lastNote = self.col.get_note(lastNoteLst[0])
+        lstNtMt = json.loads(lastNote.fields[X_FLDS_META_INDEX])
+        lstCrds = list(map(lambda o: dict(ord=o), self.col.db.list(
+            "select ord from cards where id in " + ids2str(lastNoteLst[1]))))
+        nextNotes = self.getCardData(dueAnswers=dueAnswers, cards=lstCrds,
+                                     ntMt=lstNtMt)
+
+        # if any of these children have due answers, return their first due answer
+        if len(nextNotes) > 0:
+            nextNote = self.getUrgentNote(nextNotes, nidList)
+            return self.getNextAnswer(nextNote, 0)
+
+        # check whether children of these children have due answers
+        answerFurtherDown = self.getAnswerFurtherDown(notes=nextNotes,
+                                                      dueAnswers=dueAnswers,
+                                                      nidList=nidList)
+        if answerFurtherDown:
+            return answerFurtherDown
+
+        # get Children of answers that were not answered in the last note
+        skippedCards = list(map(lambda o: dict(ord=o), self.col.db.list(
+            "select ord from cards where nid = ? and id not in " + ids2str(
+                lastNoteLst[1]), lastNoteLst[0])))
+        nextNotes = self.getCardData(dueAnswers=dueAnswers, cards=skippedCards,
+                                     ntMt=lstNtMt)
+        # if any of these children have due answers, return their first due answer
+        if len(nextNotes) > 0:
+            nextNote = self.getUrgentNote(nextNotes, nidList)
+            return self.getNextAnswer(nextNote, 0)
+
+        # check whether children of these children have due answers
+        answerFurtherDown = self.getAnswerFurtherDown(notes=nextNotes,
+                                                      dueAnswers=dueAnswers,
+                                                      nidList=nidList)
+        if answerFurtherDown:
+            return answerFurtherDown
+
+        # if no children nor children of children are due, check whether a sibling
+        # question is due and return it if necessary
+        dueSiblingNotes = []
+        siblings = []
+        for nId in getNotesFromQIds(qIds=lstNtMt['siblings'], col=self.col):
+            siblings.append(dict(nid=nId))
+            siblings[-1]['dueCards'] = getDueAnswersToNote(nId=nId,
+                                                           dueAnswers=dueAnswers,
+                                                           col=self.col)
+            if len(siblings[-1]['dueCards']) > 0:
+                dueSiblingNotes.append(
+                    dict(dueCards=siblings[-1]['dueCards'], nId=nId))
+
+        if len(dueSiblingNotes) > 0:
+            nextNote = self.getUrgentNote(dueSiblingNotes, nidList)
+            return self.getNextAnswer(nid=nextNote, aId=0)
+
+        # if no siblings are due, check whether connections are due and return them
+        # if necessary
+        connections, dueConnectionNotes = self.getDueConnectionNotes(
+            dueAnswers=dueAnswers, meta=lstNtMt)
+
+        if len(dueConnectionNotes) > 0:
+            nextNote = self.getUrgentNote(dueConnectionNotes, nidList)
+            return self.getNextAnswer(nid=nextNote, aId=0)
+
+        nxtLvlConnections = []
+        dueNxtLvlConnectionNotes = []
+        # Also check whether connections of connections have due questions
+        for connection in connections:
+            connection['note'] = self.col.get_note(connection['nid'])
+            connection['meta'] = json.loads(
+                connection['note'].fields[X_FLDS_META_INDEX])
+            nLCons, dNLConNts = self.getDueConnectionNotes(
+                dueAnswers=dueAnswers, meta=connection['meta'])
+            nxtLvlConnections.extend(nLCons)
+            dueNxtLvlConnectionNotes.extend(dNLConNts)
+        if len(dueNxtLvlConnectionNotes) > 0:
+            nextNote = self.getUrgentNote(dueNxtLvlConnectionNotes, nidList)
+            return self.getNextAnswer(nid=nextNote, aId=0)
+
+        # If the last note did not have any further questions, remove the last Item
+        # from the history and search again
+        del learnHistory[-1]
+        return self.getNextSMRCard(learnHistory)
+
+    def getDueConnectionNotes(self, dueAnswers, meta):
+        dueConnectionNotes = []
+        connections = []
+        for nId in getNotesFromQIds(qIds=meta['connections'], col=self.col):
+            connections.append(dict(nid=nId))
+            connections[-1]['dueCards'] = getDueAnswersToNote(nId=nId,
+                                                              dueAnswers=dueAnswers,
+                                                              col=self.col)
+            if len(connections[-1]['dueCards']) > 0:
+                dueConnectionNotes.append(
+                    dict(dueCards=connections[-1]['dueCards'], nId=nId))
+        return connections, dueConnectionNotes
+
+    def getUrgentNote(self, nextNotes, nidList):
+        # study notes in lrnQueue frist
+        noteCandidates = self.col.db.list(
+            "select id from notes where id in %s and id in %s" % (ids2str(
+                nidList['lrn']), ids2str(map(lambda n: n['nId'], nextNotes))))
+        if len(noteCandidates) == 0:
+            noteCandidates = self.col.db.list(
+                "select id from notes where id in %s and id in %s" % (ids2str(
+                    nidList['rev']), ids2str(
+                    map(lambda n: n['nId'], nextNotes))))
+        if len(noteCandidates) == 0:
+            noteCandidates = self.col.db.list(
+                "select id from notes where id in %s and id in %s" % (ids2str(
+                    nidList['new']), ids2str(
+                    map(lambda n: n['nId'], nextNotes))))
+        nextNote = random.choice(noteCandidates)
+        return nextNote
+
+    def getCardData(self, dueAnswers, cards, ntMt):
+        nextNotes = []
+        for crd in cards:
+            crd['children'] = []
+            for qId in ntMt['answers'][crd['ord']]['children']:
+                nId = getNotesFromQIds(qIds=[qId], col=self.col)[0]
+                dueCards = getDueAnswersToNote(nId=nId, dueAnswers=dueAnswers,
+                                               col=self.col)
+                if len(dueCards) > 0:
+                    nextNotes.append(dict(dueCards=dueCards, nId=nId))
+                crd['children'].append(dict(qId=qId, nId=nId, dueCards=dueCards))
+        return nextNotes
+
+    def getNextAnswer(self, nid, aId):
+        dueAnswers = [t[1] for t in self._lrnQueue] + self._revQueue + self._newQueue
+        dueAw2Note = list(self.col.db.execute(
+            """select id, ord from cards where nid = ? and id in """ + ids2str(
+                dueAnswers), nid))
+        awOrds = list(map(lambda t: t[1], dueAw2Note))
+        nextOrd = min(filter(lambda o: o >= aId, awOrds))
+        answerId = dueAw2Note[awOrds.index(nextOrd)][0]
+
+        return self.col.get_card(answerId)
+
+    def getAnswerFurtherDown(self, notes, dueAnswers, nidList):
+        urgntNxtLvlNotes = []
+        allNxtLvlNids = []
+        for nxtNote in notes:
+            nxtNote['note'] = self.col.get_note(nxtNote['nId'])
+            nxtNote['meta'] = json.loads(
+                nxtNote['note'].fields[X_FLDS_META_INDEX])
+            nxtNote['cards'] = list(map(lambda o: dict(ord=o), self.col.db.list(
+                "select ord from cards where nid = ?", nxtNote['nId'])))
+            urgntNxtLvlNotes.extend(
+                self.getCardData(dueAnswers=dueAnswers, cards=nxtNote['cards'],
+                                 ntMt=nxtNote['meta']))
+            for card in nxtNote['cards']:
+                for child in card['children']:
+                    allNxtLvlNids.append(dict(nId=child['nId']))
+        if len(urgntNxtLvlNotes) > 0:
+            nextNote = self.getUrgentNote(urgntNxtLvlNotes, nidList)
+            return self.getNextAnswer(nextNote, 0)
+        if len(allNxtLvlNids) > 0:
+            return self.getAnswerFurtherDown(notes=allNxtLvlNids,
+                                             dueAnswers=dueAnswers, nidList=nidList)
+        return None
+
+
+@pytest.fixture
+def answer_links() -> bool:
+    return True
+
+
+@pytest.fixture
+def imported_maps(tmp_path, answer_links):
+    """
+    Generated maps instead of the example map
+    """
+    map_paths = []
+    for seed in range(N_GENERATED_MAPS):
+        map_paths.append(str(tmp_path / ('generated%d.xmind' % seed)))
+        write_generated_map(map_paths[-1], seed, answer_links=answer_links)
+    return map_paths
+
+
+def test_get_next_smr_card_selects_cards_like_recursive_selection(smr_collection):
+    # Given
+    col = smr_collection
+    sched = col.sched
+    random.seed(0)
+    learn_history = []
+
+    for review in range(N_REVIEWS):
+        # When
+        random_state = random.getstate()
+        expected_history = [[nid, list(cids)] for nid, cids in learn_history]
+        expected_card = RecursiveSelection(col).getNextSMRCard(expected_history)
+        random.setstate(random_state)
+        card = sched.getNextSMRCard(learn_history)
+
+        # Then
+        assert (card and card.id) == (expected_card and expected_card.id)
+        assert learn_history == expected_history
+        if not card:
+            break
+        if len(learn_history) > 0 and learn_history[-1][0] == card.nid:
+            learn_history[-1][1].append(card.id)
+        else:
+            learn_history.append([card.nid, [card.id]])
+        card.start_timer()
+        sched.answerCard(card, 1 + review % 4 if card.queue else 2 + review % 3)
+        onCardAnswered(card)
+
+
+@pytest.mark.parametrize('answer_links', [False])
+@pytest.mark.parametrize('n_due_notes', [None, 10])
+def test_get_answer_further_down_selects_cards_like_recursive_search(smr_collection, n_due_notes):
+    # Given
+    col = smr_collection
+    sched = col.sched
+    sched.getNextSMRCard([])
+    nids = col.db.list("select id from notes order by id")
+    due_nids = set(random.Random(0).sample(nids, n_due_notes) if n_due_notes else nids)
+    nid_list = dict(lrn=set(), rev=set(), new=due_nids)
+    due_answers = set(col.db.list("select id from cards where nid in %s" % ids2str(due_nids)))
+    sched.smrDueCids = due_answers
+
+    recursive_selection = RecursiveSelection(col)
+    recursive_selection._lrnQueue, recursive_selection._revQueue = [], []
+    recursive_selection._newQueue = list(due_answers)
+    recursive_nid_list = {queue: list(queue_nids) for queue, queue_nids in nid_list.items()}
+
+    for nid in nids:
+        # When
+        random.seed(nid)
+        expected_card = recursive_selection.getAnswerFurtherDown(
+            [dict(nId=nid)], recursive_selection._newQueue, recursive_nid_list)
+        sched.smrVisitedNids = set()
+        sched.smrExpandedNids = set()
+        random.seed(nid)
+        answer_id = sched.getAnswerFurtherDown([dict(nId=nid)], due_answers, nid_list)
+
+        # Then
+        assert answer_id == (expected_card and expected_card.id)
+
+
+def test_get_next_smr_card_with_long_learn_history(smr_collection):
+    # Given
+    col = smr_collection
+    sched = col.sched
+    nid = col.db.scalar("select min(id) from notes")
+    learn_history = [[nid, col.db.list("select id from cards where nid = ?", nid)] for _ in range(5000)]
+
+    # When
+    card = sched.getNextSMRCard(learn_history)
+
+    # Then
+    assert card
+
+
+def test_smr_queues_are_updated_with_answered_cards(smr_collection):
+    # Given
+    col = smr_collection
+    sched = col.sched
+    card = sched.getNextSMRCard([])
+    nid_list = sched.setSMRQueues(getDueQueues(sched), time.time())
+    card.start_timer()
+
+    # When
+    sched.answerCard(card, 4)
+    onCardAnswered(card)
+
+    # Then
+    did = col.decks.id(name=TEST_DECK_NAME)
+    assert list(sched._newQueue) == col.db.list("select id from cards where did = ? and queue = 0 order by due, ord",
+                                                did)
+    assert card.id not in sched.smrDueCids
+    assert set(nid_list['new']) == set(col.db.list("select nid from cards where did = ? and queue = 0", did))
+
+
+def test_get_urgent_note_prefers_learning_then_review_notes(smr_collection):
+    # Given
+    sched = smr_collection.sched
+    next_notes = [dict(nId=nid) for nid in (1, 2, 3)]
+
+    # When
+    learning_note = sched.getUrgentNote(next_notes, dict(lrn={3, 4}, rev={1, 2}, new={1, 2, 3}))
+    review_note = sched.getUrgentNote(next_notes, dict(lrn={4}, rev={2}, new={1, 2, 3}))
+
+    # Then
+    assert learning_note == 3
+    assert review_note == 2
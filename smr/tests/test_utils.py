@@ -0,0 +1,31 @@
+from smr.tests.constants import TEST_DECK_NAME
+from smr.utils import invalidateSMRDecks, isSMRDeck
+
+
+def test_is_smr_deck(smr_collection):
+    # Given
+    col = smr_collection
+
+    # When
+    is_smr_deck = isSMRDeck(col.decks.id(name=TEST_DECK_NAME), col)
+    is_other_deck_smr_deck = isSMRDeck(col.decks.id(name='other deck'), col)
+
+    # Then
+    assert is_smr_deck
+    assert not is_other_deck_smr_deck
+
+
+def test_is_smr_deck_after_moving_cards(smr_collection):
+    # Given
+    col = smr_collection
+    did = col.decks.id(name=TEST_DECK_NAME)
+    other_did = col.decks.id(name='other deck')
+    assert not isSMRDeck(other_did, col)
+
+    # When
+    col.set_deck(col.db.list("select id from cards where did = ?", did), other_did)
+    invalidateSMRDecks()
+
+    # Then
+    assert isSMRDeck(other_did, col)
+    assert not isSMRDeck(did, col)
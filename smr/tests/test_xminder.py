@@ -1,9 +1,12 @@
+import json
 import os
 
 import pytest
 from anki.collection import Collection
+from anki.utils import join_fields
 
 from smr.tests.constants import TEMPORARY_EMPTY_COLLECTION_FUNCTION_PATH, PATH_EXAMPLE_MAP_DEFAULT, TEST_DECK_NAME
+from smr.dto.deckselectiondialoguserinputsdto import DeckSelectionDialogUserInputsDTO
 from smr.xminder import XmindImporter
 from smr.template import add_x_model
 
@@ -27,12 +30,12 @@ def test_import_example_map(empty_anki_collection_function):
     test_deck_id = empty_anki_collection_function.decks.id(name=TEST_DECK_NAME)
     importer.deckId = test_deck_id
     import_data = {
-        'sheet': importer.soup('sheet')[0],
+        'sheet': importer.content.sheets[0],
         'tag': "hi",
         'deckId': test_deck_id,
     }
     importer.currentSheetImport = import_data
-    importer.currentSheetImport['ID'] = importer.currentSheetImport['sheet']['id']
+    importer.currentSheetImport['ID'] = importer.currentSheetImport['sheet'].id
     importer.notesToAdd[importer.currentSheetImport['ID']] = []
     importer.log = [['Added', 0, 'notes'], ['updated', 0, 'notes'], ['removed', 0, 'notes']]
 
@@ -44,3 +47,139 @@ def test_import_example_map(empty_anki_collection_function):
     # Then
     n_cards_imported = len(empty_anki_collection_function.db.execute("select * from cards where did = ?", test_deck_id))
     assert n_cards_imported == N_CARDS_EXAMPLE_MAP
+
+
+def test_import_sheets_clears_caches(empty_anki_collection_function, mocker):
+    # Given
+    importer = XmindImporter(col=empty_anki_collection_function, file=PATH_EXAMPLE_MAP_DEFAULT)
+    importer.mw = mocker.MagicMock()
+    user_inputs = DeckSelectionDialogUserInputsDTO(
+        deck_id=empty_anki_collection_function.decks.id(name=TEST_DECK_NAME), deck_name=TEST_DECK_NAME)
+    find_question_lists = mocker.spy(importer.compiler, 'findQuestionLists')
+
+    # When
+    importer.importSheets(user_inputs)
+
+    # Then
+    assert importer.log == ['Added 21 notes, updated 0 notes, removed 0 notes']
+    assert find_question_lists.call_count == len(
+        set((c.kwargs['answerDict']['nodeTag'].id, c.kwargs['goDeeper']) for c in find_question_lists.call_args_list))
+    assert not importer.compiler.questionListCache
+    assert not importer.compiler.answerDictCache
+    assert not importer.compiler.nodeContentCache
+
+
+def test_import_all_sheets(empty_anki_collection_function, mocker):
+    # Given
+    importer = XmindImporter(col=empty_anki_collection_function, file=PATH_EXAMPLE_MAP_DEFAULT)
+    importer.mw = mocker.MagicMock()
+    user_inputs = DeckSelectionDialogUserInputsDTO(
+        deck_id=empty_anki_collection_function.decks.id(name=TEST_DECK_NAME), deck_name=TEST_DECK_NAME,
+        all_sheets=True)
+
+    # When
+    importer.importSheets(user_inputs)
+
+    # Then
+    assert set(importer.notesToAdd) == set(sheet.id for sheet in importer.content.sheets)
+    assert sorted(empty_anki_collection_function.tags.all()) == [
+        TEST_DECK_NAME + '::biological_psychology', TEST_DECK_NAME + '::clinical_psychology']
+    assert importer.counts['added'] == sum(len(notes) for notes in importer.notesToAdd.values())
+
+
+def test_import_given_sheets(empty_anki_collection_function, mocker):
+    # Given
+    importer = XmindImporter(col=empty_anki_collection_function, file=PATH_EXAMPLE_MAP_DEFAULT)
+    importer.mw = mocker.MagicMock()
+    user_inputs = DeckSelectionDialogUserInputsDTO(
+        deck_id=empty_anki_collection_function.decks.id(name=TEST_DECK_NAME), deck_name=TEST_DECK_NAME)
+    sheet = importer.content.sheets[1]
+
+    # When
+    importer.importSheets(user_inputs, sheets=[sheet])
+
+    # Then
+    assert set(importer.notesToAdd) == {sheet.id}
+    assert empty_anki_collection_function.tags.all() == [TEST_DECK_NAME + '::clinical_psychology']
+
+
+def test_import_sheets_inserts_notes_in_chunks(empty_anki_collection_function, mocker):
+    # Given
+    col = empty_anki_collection_function
+    mocker.patch('smr.xminder.X_NOTE_INSERT_CHUNK_SIZE', 4)
+    importer = XmindImporter(col=col, file=PATH_EXAMPLE_MAP_DEFAULT)
+    importer.mw = mocker.MagicMock()
+    test_deck_id = col.decks.id(name=TEST_DECK_NAME)
+    after_note_updates = mocker.spy(col, 'after_note_updates')
+
+    # When
+    importer.importSheets(DeckSelectionDialogUserInputsDTO(deck_id=test_deck_id, deck_name=TEST_DECK_NAME))
+
+    # Then
+    assert after_note_updates.call_count == 6
+    assert col.db.list('select distinct did from cards') == [test_deck_id]
+    # new cards are due in map order, cards of the same note share their position
+    due_by_note = col.db.all('select n.id, min(c.due), max(c.due) from notes n join cards c on c.nid = n.id '
+                             'group by n.id order by n.id')
+    assert [min_due for _, min_due, _ in due_by_note] == [max_due for _, _, max_due in due_by_note]
+    assert [min_due for _, min_due, _ in due_by_note] == list(range(due_by_note[0][1], due_by_note[0][1] + 21))
+    assert col.db.scalar("select count() from notes where sfld = '' or csum = 0") == 0
+
+
+def test_match_notes_by_question_id(empty_anki_collection_function):
+    # Given
+    def flds(question_id, question):
+        return join_fields(['', question] + [''] * 21 + [json.dumps(dict(questionId=question_id))])
+
+    importer = XmindImporter(col=empty_anki_collection_function, file=PATH_EXAMPLE_MAP_DEFAULT)
+    existing_notes = [[1, flds('a', 'qa')], [2, flds('b', 'qb')], [3, flds('c', 'qc')]]
+    new_notes = [[None] * 6 + [flds(question_id, question)] for question_id, question in
+                 [('a', 'qa'), ('b', 'changed'), ('d', 'qd')]]
+
+    # When
+    notes_to_add, notes_to_update, notes_to_remove = importer.matchNotesByQuestionId(existing_notes, new_notes)
+
+    # Then
+    assert notes_to_add == [new_notes[2]]
+    assert notes_to_update == [[existing_notes[1], new_notes[1]]]
+    assert notes_to_remove == [existing_notes[2]]
+
+
+def test_match_notes_by_content(empty_anki_collection_function):
+    # Given
+    def flds(question_id, question, answer):
+        return join_fields(['', question, answer] + [''] * 20 + [json.dumps(dict(questionId=question_id))])
+
+    importer = XmindImporter(col=empty_anki_collection_function, file=PATH_EXAMPLE_MAP_DEFAULT)
+    existing_notes = [[1, flds('a', 'qa', 'aa')], [2, flds('b', 'qb', 'ab')], [3, flds('c', 'qc', 'ac')],
+                      [4, flds('d', 'qd', 'ad')]]
+    new_notes = [[None] * 6 + [flds(question_id, question, answer)] for question_id, question, answer in
+                 [('x', 'qa', 'aa'), ('y', 'qb ', 'ab'), ('z', 'c', 'ac'), ('w', 'qe', 'ae')]]
+
+    # When
+    notes_to_add, notes_to_update, notes_to_remove = importer.matchNotesByContent(existing_notes, new_notes)
+
+    # Then
+    assert notes_to_add == [new_notes[3]]
+    assert notes_to_update == [[existing_notes[0], new_notes[0]], [existing_notes[1], new_notes[1]],
+                               [existing_notes[2], new_notes[2]]]
+    assert notes_to_remove == [existing_notes[3]]
+
+
+def test_get_card_updates(empty_anki_collection_function, mocker):
+    # Given
+    col = empty_anki_collection_function
+    importer = XmindImporter(col=col, file=PATH_EXAMPLE_MAP_DEFAULT)
+    importer.mw = mocker.MagicMock()
+    importer.importSheets(DeckSelectionDialogUserInputsDTO(deck_id=col.decks.id(name=TEST_DECK_NAME),
+                                                           deck_name=TEST_DECK_NAME))
+    nid = col.db.scalar("select nid from cards group by nid having count() = 2")
+    # old values are matched by ord, not by the order of the cards' ids
+    col.db.execute("update cards set ord = 1 - ord, ivl = 11 - ord where nid = ?", nid)
+
+    # When
+    card_updates = importer.getCardUpdates([(nid, ['a', 'b'], ['b', 'c', 'a'])])
+
+    # Then
+    assert [c[3] for c in card_updates] == [11, '0', '0']
+    assert [c[-2:] for c in card_updates] == [[str(nid), '0'], [str(nid), '1'], [str(nid), '2']]
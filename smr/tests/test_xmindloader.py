@@ -0,0 +1,57 @@
+import zipfile
+
+import pytest
+
+from smr.consts import X_PARSER_SOUP, X_PARSER_STREAM
+from smr.tests.constants import PATH_EXAMPLE_MAP_DEFAULT
+from smr.xmindloader import loadContent
+
+
+def topic_tuple(topic):
+    return (topic.id, topic.title, topic.image, topic.hyperlink, topic.crosslink, topic.depth,
+            topic.parent.id if topic.parent else None, tuple(child.id for child in topic.children))
+
+
+def test_stream_parser_equals_soup_parser():
+    # Given
+    x_zip = zipfile.ZipFile(PATH_EXAMPLE_MAP_DEFAULT, 'r')
+
+    # When
+    stream_content = loadContent(x_zip, parser=X_PARSER_STREAM)
+    soup_content = loadContent(x_zip, parser=X_PARSER_SOUP)
+
+    # Then
+    assert [(s.id, s.title, s.rootTopic.id) for s in stream_content.sheets] == \
+           [(s.id, s.title, s.rootTopic.id) for s in soup_content.sheets]
+    assert list(map(topic_tuple, stream_content.topics)) == list(map(topic_tuple, soup_content.topics))
+    assert len(stream_content.sheets) == 2
+    assert stream_content.sheets[0].rootTopic.title == 'biological psychology'
+
+
+def test_load_content_unknown_parser():
+    with pytest.raises(ValueError):
+        loadContent(zipfile.ZipFile(PATH_EXAMPLE_MAP_DEFAULT, 'r'), parser='dom')
+
+
+def test_map_nodes_are_frozen():
+    # When
+    content = loadContent(zipfile.ZipFile(PATH_EXAMPLE_MAP_DEFAULT, 'r'))
+
+    # Then
+    root = content.sheets[0].rootTopic
+    assert root.depth == 0
+    assert isinstance(root.children, tuple)
+    assert all(child.parent is root and child.depth == 1 for child in root.children)
+    assert not hasattr(root, '__dict__')
+    crosslinked = [topic for topic in content.topics if topic.crosslink]
+    assert all(topic.hyperlink == 'xmind:#' + topic.crosslink for topic in crosslinked)
+
+
+def test_topic_index():
+    # When
+    content = loadContent(zipfile.ZipFile(PATH_EXAMPLE_MAP_DEFAULT, 'r'))
+
+    # Then
+    assert len(content.topicsById) == len(content.topics)
+    assert all(content.getTopic(topic.id) is topic for topic in content.topics)
+    assert content.getTopic('deleted topic id') is None
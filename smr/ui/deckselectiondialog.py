@@ -24,10 +24,12 @@ class DeckSelectionDialog(QDialog):
         self.deck_text = 'Choose Deck for map "%s":' % filename
         self.deck = None
         self.repair_checkbox = None
+        self.all_sheets_checkbox = None
         self._running = True
         self._deck_id: Optional[int] = None
         self._deck_name: str = ''
         self._repair = False
+        self._all_sheets = False
         self.tags = dict()
         self._build()
         self.exec()
@@ -40,10 +42,12 @@ class DeckSelectionDialog(QDialog):
         self._deck_id = self.deck.selectedId()
         self._deck_name = self.deck.deckName()
         self._repair = self.repair_checkbox.isChecked()
+        self._all_sheets = self.all_sheets_checkbox.isChecked()
         super().accept()
 
     def get_inputs(self) -> DeckSelectionDialogUserInputsDTO:
-        return DeckSelectionDialogUserInputsDTO(repair=self._repair, deck_id=self._deck_id, deck_name=self._deck_name, running=self._running)
+        return DeckSelectionDialogUserInputsDTO(repair=self._repair, deck_id=self._deck_id, deck_name=self._deck_name,
+                                                all_sheets=self._all_sheets, running=self._running)
 
     def _build(self) -> None:
         """
@@ -83,6 +87,12 @@ class DeckSelectionDialog(QDialog):
         self.repair_checkbox = repair_checkbox
         col_1_row_2.addWidget(repair_checkbox)
 
+        # Add the checkbox element for indicating whether to import all sheets of the xmind file
+        all_sheets_checkbox = QtWidgets.QCheckBox(widget)
+        all_sheets_checkbox.setText('All sheets')
+        self.all_sheets_checkbox = all_sheets_checkbox
+        col_1_row_2.addWidget(all_sheets_checkbox)
+
         buttons = QtWidgets.QDialogButtonBox(widget)
         buttons.setStandardButtons(
             QtWidgets.QDialogButtonBox.StandardButton.Cancel | QtWidgets.QDialogButtonBox.StandardButton.Ok)
@@ -1,4 +1,7 @@
+import hashlib
+import json
 import re
+import unicodedata
 import urllib.parse
 import os
 import zipfile
@@ -6,28 +9,12 @@ import tempfile
 import shutil
 from bs4 import BeautifulSoup
 
-from anki.utils import ids2str
+from anki.utils import ids2str, split_fields
 
-from .consts import X_MODEL_NAME
+from .consts import X_FLDS_CONTENT_SLICE, X_FLDS_META_INDEX, X_MODEL_NAME
 
-
-# checks whether a node contains any text, images or link
-def isEmptyNode(tag):
-    if getNodeTitle(tag):
-        return False
-    if getNodeImg(tag):
-        return False
-    if getNodeHyperlink(tag):
-        return False
-    return True
-
-
-def isQuestionNode(tag, level=0):
-    # If the Tag is the root topic, return true if the length of the path is odd
-    if tag.parent.name == 'sheet':
-        return level % 2 == 1
-    # Else add one to the path length and test again
-    return isQuestionNode(tag.parent.parent.parent, level + 1)
+# whether decks contain smr notes, by collection path and deck id
+_smrDecks = dict()
 
 
 # receives a dictionary with an id for sorting the cards and an id for finding the card's position
@@ -53,50 +40,43 @@ def getCoordsFromId(sortId):
     return coords
 
 
-# receives a topic's id attribute, a BeautifulSoup object representing an
-# xmind content xml file and a WorkbookDocument for the same map and returns
-# the corresponding topic as a WorkbookElement
-def getTopicById(tId, importer):
-    tag = importer.soup.find('topic', {'id': tId})
-    if not tag:
-        return None
-    # get tags that make up the path to the desired topic
-    parents = list(tag.parents)
-    topicPath = [tag]
-    parentTopics = list(
-        filter(lambda parent: parent.name == 'topic', parents))
-    if len(parentTopics) > 1:
-        topicPath.extend(parentTopics[:-1])
-    # get the sheet that contains the topic
-    sheetTag = list(reversed(parents))[2]
-    sheetNr = len(list(sheetTag.previous_siblings))
-    # noinspection PyProtectedMember
-    sheet = importer.currentSheetImport['sheet']._owner_workbook.getSheets()[
-        sheetNr]
-    # starting at the root topic follow the path described by the tags to
-    # get the desired topic
-    topic = sheet.getRootTopic()
-    for topicTag in reversed(topicPath):
-        topicNr = len(list(topicTag.previous_siblings))
-        topic = topic.getSubTopics()[topicNr]
-    return topic
-
-
-def getAnswerDict(nodeTag):
+def getAnswerDict(node):
     # Check whether subtopic is not empty
     isAnswer = True
-    if isEmptyNode(nodeTag):
+    if node.isEmpty:
         isAnswer = False
     # Check whether subtopic contains a crosslink
-    crosslink = getNodeCrosslink(nodeTag)
-    return dict(nodeTag=nodeTag, isAnswer=isAnswer, aId=str(0),
+    crosslink = node.crosslink
+    return dict(nodeTag=node, isAnswer=isAnswer, aId=str(0),
                 crosslink=crosslink)
 
 
+def questionIdFromFields(flds):
+    """returns the question id from the meta field of a note's joined fields"""
+    return json.loads(split_fields(flds)[X_FLDS_META_INDEX])['questionId']
+
+
+def contentFingerprint(fields):
+    """returns a hash of the question and answers in the fields of a note
+    that does not depend on whitespace or unicode normalization"""
+    content = '\x1f'.join(' '.join(unicodedata.normalize('NFC', field).split())
+                           for field in fields[X_FLDS_CONTENT_SLICE])
+    return hashlib.sha1(content.encode('utf-8')).digest()
+
+
+def getNotesFromTag(tag, mid, col):
+    """returns the ids and fields of all notes of the model with id mid whose
+    tags contain tag"""
+    pattern = '%' + re.sub(r'([\\%_])', r'\\\1', tag) + '%'
+    return col.db.all(
+        "select id, flds from notes where mid = ? and tags like ? escape '\\'",
+        mid, pattern)
+
+
 def getNotesFromSheet(sheetId, col):
-    notes = list(col.db.execute(
-        "select id, flds from notes where flds like '%\"sheetId\": \"" +
-        sheetId + "\"%'"))
+    notes = col.db.all("""
+        select n.id, n.flds from smr_notes i join notes n on n.id = i.nid
+        where i.sheet_id = ? order by i.nid""", sheetId)
     if len(notes) > 0:
         return notes
     else:
@@ -104,11 +84,20 @@ def getNotesFromSheet(sheetId, col):
 
 
 def isSMRDeck(did, col):
-    nidsInDeck = set(nid for nid_list in col.db.execute(
-        "select nid from cards where did = " + str(did)) for nid in nid_list)
-    midsInDeck = set(mid for mid_list in col.db.execute(
-        "select mid from notes where id in " + ids2str(nidsInDeck)) for mid in mid_list)
-    return xModelId(col) in midsInDeck
+    """returns whether the deck with id did contains cards of smr notes, the
+    result is cached until invalidateSMRDecks() is called"""
+    key = (col.path, did)
+    if key not in _smrDecks:
+        _smrDecks[key] = bool(col.db.scalar("""
+            select exists(select 1 from cards c join notes n on n.id = c.nid
+            where c.did = ? and n.mid = ?)""", did, xModelId(col)))
+    return _smrDecks[key]
+
+
+def invalidateSMRDecks():
+    """needs to be called whenever smr notes are imported or cards are moved to
+    other decks"""
+    _smrDecks.clear()
 
 
 def xModelId(col):
@@ -116,35 +105,44 @@ def xModelId(col):
 
 
 def getNotesFromQIds(qIds, col):
-    return sum(map(lambda qId: col.db.list(
-        "select id from notes where flds like '%\"questionId\": \"" +
-        qId + "\"%'"), qIds), [])
-
-
-def getDueAnswersToNote(nId, dueAnswers, col):
-    cardTpls = list(col.db.execute(
-        """select id, ord from cards where nid = ? and id in """ + ids2str(
-            dueAnswers), nId))
-    cards = []
-    for cardTpl in cardTpls:
-        cards.append(dict(cId=cardTpl[0], ord=cardTpl[1]))
-    return cards
-
-
-def getNodeContent(tagList, tag):
+    """returns the ids of the notes of the questions with ids qIds in the
+    order of qIds"""
+    qIds = list(qIds)
+    if not qIds:
+        return []
+    nIdsByQId = dict()
+    for qId, nId in col.db.execute("""
+            select i.question_id, i.nid from smr_notes i
+            join notes n on n.id = i.nid
+            where i.question_id in (%s) order by i.nid""" %
+                                   ', '.join('?' * len(qIds)), *qIds):
+        nIdsByQId.setdefault(qId, []).append(nId)
+    return [nId for qId in qIds for nId in nIdsByQId.get(qId, [])]
+
+
+def getSheetTagAndDeck(sheetId, col):
+    """returns the tags of the first note of the sheet with id sheetId and
+    the deck of that note's first card"""
+    return col.db.first("""
+        select n.tags, c.did from smr_notes i join notes n on n.id = i.nid
+        join cards c on c.nid = n.id
+        where i.sheet_id = ? order by i.nid, c.id limit 1""", sheetId)
+
+
+def getNodeContent(topicsById, node):
     content = ''
     media = dict(image=None, media=None)
-    href = getNodeHyperlink(tag)
-    title = getNodeTitle(tag)
+    href = node.hyperlink
+    title = node.title
 
     if title:
         content += '<span class = "title">' + title
 
     # If the node contains a link to another node, add the text of that
-    # node. Use Beautifulsoup because minidom can't find nodes by attributes
-    if href and href.startswith('xmind:#'):
-        crosslinkTag = getTagById(tagList=tagList, tagId=href[7:])
-        crosslinkTitle = getNodeTitle(crosslinkTag)
+    # node
+    if node.crosslink:
+        crosslinkNode = topicsById.get(node.crosslink)
+        crosslinkTitle = crosslinkNode.title if crosslinkNode else ''
         if content:
             content += ' '
             content += crosslinkTitle
@@ -154,7 +152,7 @@ def getNodeContent(tagList, tag):
         content += '</span>'
 
     # if necessary add image
-    attachment = getNodeImg(tag=tag)
+    attachment = node.image
     if attachment:
         if content != '':
             content += '<br>'
@@ -176,13 +174,6 @@ def getNodeContent(tagList, tag):
     return content, media
 
 
-def getTagById(tagList, tagId):
-    try:
-        return tuple(filter(lambda t: t['id'] == tagId, tagList))[0]
-    except IndexError:
-        return None
-
-
 def getNodeTitle(tag):
     try:
         return tag.find('title', recursive=False).text
@@ -208,14 +199,6 @@ def getNodeHyperlink(tag):
         return None
 
 
-def getNodeCrosslink(tag):
-    href = getNodeHyperlink(tag)
-    if href and href.startswith('xmind:#'):
-        return href[7:]
-    else:
-        return None
-
-
 def getChildnodes(tag):
     try:
         return tag.find('children', recursive=False).find(
@@ -0,0 +1,169 @@
+"""Loaders that turn the content.xml of an xmind 8 file into sheets and topics"""
+import xml.etree.ElementTree as ElementTree
+from typing import Dict, List, Optional
+
+from bs4 import BeautifulSoup
+
+from .consts import X_PARSER_SOUP, X_PARSER_STREAM
+from .mapnode import MapNode, freezeNodes
+from .utils import getChildnodes, getNodeHyperlink, getNodeImg, getNodeTitle
+
+CONTENT_XML = 'content.xml'
+
+# qualified element and attribute names as reported by ElementTree
+_CONTENT_NS = '{urn:xmind:xmap:xmlns:content:2.0}'
+_SHEET = _CONTENT_NS + 'sheet'
+_TOPIC = _CONTENT_NS + 'topic'
+_TOPICS = _CONTENT_NS + 'topics'
+_CHILDREN = _CONTENT_NS + 'children'
+_TITLE = _CONTENT_NS + 'title'
+_IMG = '{http://www.w3.org/1999/xhtml}img'
+_IMG_SRC = '{http://www.w3.org/1999/xhtml}src'
+_HREF = '{http://www.w3.org/1999/xlink}href'
+
+
+class XmindSheet:
+    """
+    A sheet of an xmind file
+    """
+
+    def __init__(self, id: str, title: str = ''):
+        self.id = id
+        self.title = title
+        self.rootTopic: Optional[MapNode] = None
+        # all topics of the sheet in document order
+        self.topics: List[MapNode] = []
+        # whether the sheet's topics were annotated by sheetanalyzer.analyzeSheet()
+        self.analyzed = False
+
+
+class XmindContent:
+    """
+    Sheets and topics of an xmind file's content.xml
+    """
+
+    def __init__(self):
+        self.sheets: List[XmindSheet] = []
+        # all topics of the document in document order
+        self.topics: List[MapNode] = []
+        # index of all topics by their id attribute, built while the document is loaded
+        self.topicsById: Dict[str, MapNode] = dict()
+
+    def addTopic(self, topic: MapNode) -> None:
+        self.topics.append(topic)
+        self.topicsById[topic.id] = topic
+
+    def getTopic(self, topicId: str) -> Optional[MapNode]:
+        """
+        Returns the topic with the specified id or None if the document does not contain a topic with this id
+        """
+        return self.topicsById.get(topicId)
+
+
+def loadContent(xZip, parser: str = X_PARSER_STREAM) -> XmindContent:
+    """
+    Reads the content.xml of an xmind file with the specified parser
+    :param xZip: the opened xmind file as zipfile.ZipFile
+    :param parser: X_PARSER_STREAM for the incremental ElementTree parser or X_PARSER_SOUP for BeautifulSoup
+    :return: the content of the xmind file
+    """
+    if parser == X_PARSER_STREAM:
+        return loadContentStream(xZip)
+    if parser == X_PARSER_SOUP:
+        return loadContentSoup(xZip)
+    raise ValueError('Unknown content parser "%s"' % parser)
+
+
+def loadContentStream(xZip) -> XmindContent:
+    """
+    Builds the content of an xmind file incrementally from the parser events of content.xml, elements are discarded as
+    soon as the data of the topic or sheet they belong to is read
+    """
+    content = XmindContent()
+    sheet = None
+    # tags of all open elements
+    elementStack = []
+    # all open topics and the number of topics elements that were opened in their children element
+    topicStack = []
+    groupCounts = []
+    # whether the open topics elements contain attached subtopics of their topic
+    attachedStack = []
+    with xZip.open(CONTENT_XML) as contentFile:
+        for event, element in ElementTree.iterparse(contentFile, events=('start', 'end')):
+            tag = element.tag
+            if event == 'start':
+                if tag == _TOPIC:
+                    parent = topicStack[-1] if topicStack else None
+                    topic = MapNode(id=element.get('id'), hyperlink=element.get(_HREF), parent=parent)
+                    if not parent:
+                        if not sheet.rootTopic:
+                            sheet.rootTopic = topic
+                    elif attachedStack and attachedStack[-1]:
+                        parent.children.append(topic)
+                    content.addTopic(topic)
+                    sheet.topics.append(topic)
+                    topicStack.append(topic)
+                    groupCounts.append(0)
+                elif tag == _TOPICS:
+                    # like bs4 find(), only the first topics element in a children element contains subtopics
+                    attached = elementStack[-1] == _CHILDREN and len(elementStack) > 1 and \
+                               elementStack[-2] == _TOPIC and groupCounts[-1] == 0
+                    if elementStack[-1] == _CHILDREN:
+                        groupCounts[-1] += 1
+                    attachedStack.append(attached)
+                elif tag == _SHEET:
+                    sheet = XmindSheet(id=element.get('id'))
+                    content.sheets.append(sheet)
+                elementStack.append(tag)
+                continue
+            elementStack.pop()
+            if tag == _TITLE:
+                owner = elementStack[-1] if elementStack else None
+                if owner == _TOPIC and not topicStack[-1].title:
+                    topicStack[-1].title = ''.join(element.itertext())
+                elif owner == _SHEET and not sheet.title:
+                    sheet.title = ''.join(element.itertext())
+            elif tag == _IMG:
+                if elementStack and elementStack[-1] == _TOPIC and not topicStack[-1].image:
+                    topicStack[-1].image = element.get(_IMG_SRC)
+            elif tag == _TOPICS:
+                attachedStack.pop()
+            elif tag == _TOPIC:
+                topicStack.pop()
+                groupCounts.pop()
+                element.clear()
+            elif tag == _SHEET:
+                freezeNodes(sheet.topics)
+                element.clear()
+    return content
+
+
+def loadContentSoup(xZip) -> XmindContent:
+    """
+    Builds the content of an xmind file from a BeautifulSoup of the whole content.xml
+    """
+    return contentFromSoup(BeautifulSoup(xZip.read(CONTENT_XML), features='html.parser'))
+
+
+def contentFromSoup(soup: BeautifulSoup) -> XmindContent:
+    """
+    Builds the content of an xmind file from an already parsed BeautifulSoup of its content.xml
+    """
+    content = XmindContent()
+    for sheetTag in soup('sheet'):
+        sheet = XmindSheet(id=sheetTag['id'], title=getNodeTitle(sheetTag))
+        content.sheets.append(sheet)
+        for tag in sheetTag('topic'):
+            parentTag = tag.find_parent('topic')
+            parent = content.getTopic(parentTag['id']) if parentTag else None
+            topic = MapNode(id=tag['id'], title=getNodeTitle(tag), image=getNodeImg(tag),
+                            hyperlink=getNodeHyperlink(tag), parent=parent)
+            if not parent:
+                if not sheet.rootTopic:
+                    sheet.rootTopic = topic
+            elif any(child is tag for child in getChildnodes(parentTag)):
+                parent.children.append(topic)
+            content.addTopic(topic)
+            sheet.topics.append(topic)
+        freezeNodes(sheet.topics)
+    return content
@@ -16,6 +16,7 @@ def retrieve_file_paths(dirName):
         'resources',
         'screenshots',
         'ankiweb',
+        'user_files',
     }
     files_2_exlude = {
         '.gitignore',